@@ -1,9 +1,53 @@
 #!/usr/bin/env python3
+"""Start the uplink server.
 
-import anvil.server
+    ./run_server.py             # One process
+    ./run_server.py --shards 4  # Four processes, each owning the games of a quarter of the pairs of players
+
+Clients reach the server through the Anvil uplink, so SONORA_UPLINK_KEY is always needed,
+whichever backend (SONORA_BACKEND) the data is kept in.
+Shards share the backend, so they all need the same SONORA_BACKEND (and SONORA_DB, for SQLite).
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+def launch(shards):
+    """Start one copy of this script per shard, and keep them running until interrupted."""
+    processes = [
+        subprocess.Popen(
+            [sys.executable, __file__], env={**os.environ, "SONORA_SHARDS": str(shards), "SONORA_SHARD": str(shard)}
+        )
+        for shard in range(shards)
+    ]
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
 
-# import to register server functions
-from sonora import server
 
 if __name__ == "__main__":
-    anvil.server.wait_forever()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--shards", type=int, default=1, help="Server processes to start (one per core is a good start)"
+    )
+    args = parser.parse_args()
+
+    if args.shards > 1 and "SONORA_SHARD" not in os.environ:
+        launch(args.shards)
+    else:
+        import anvil.server
+
+        anvil.server.connect(os.environ["SONORA_UPLINK_KEY"])
+
+        # sonora.server imports Kivy (through sonora.models), which would otherwise try to parse our arguments
+        os.environ.setdefault("KIVY_NO_ARGS", "1")
+
+        # import to register server functions
+        from sonora import server  # noqa: F401
+
+        anvil.server.wait_forever()
@@ -1,5 +1,9 @@
+import os
+
 import anvil.server
 from kivy.app import App
+from kivy.storage.jsonstore import JsonStore
+from loguru import logger
 
 from sonora.board_objects import AnimalTypes
 from sonora.models import Game, GameSetup, User
@@ -25,10 +29,40 @@ class SonoraApp(App):
         self.db_poll = DBPoll(self.game, self.user)
         self.sm = get_screen_manager()
 
+        self.session_store = JsonStore(os.path.join(self.user_data_dir, "session.json"))
+        self.user.bind(session_token=self.save_session)
+        self.resume_session()
+
         # temp code
         from sonora.buttons import LoginBtn, ResumeGameBtn
 
         # LoginBtn().login("jk", "bad")
-        # ResumeGameBtn(self.user.game_rows[0]).on_press()
+        # ResumeGameBtn(self.user.game_summaries[0]).on_press()
 
         return self.sm
+
+    def save_session(self, _, token):
+        self.session_store.put("session", token=token)
+
+    def resume_session(self):
+        """Returning players with a live session go straight to user_home, without logging in again."""
+        if not self.session_store.exists("session"):
+            return
+        token = self.session_store.get("session")["token"]
+        try:
+            session = anvil.server.call("resume_session", token)
+        except Exception as err:  # Including servers without `resume_session`. Either way, log in as usual.
+            logger.warning(f"Couldn't resume the saved session ({err}).")
+            return
+        if isinstance(session, str):  # The server is busy, so log in as usual rather than dropping the session
+            logger.info(session)
+            return
+        if session is None:
+            logger.info("Saved session has expired.")
+            self.session_store.delete("session")
+            return
+        logger.info(f"Resuming session for {session['username']}")
+        self.user.session_token = token
+        self.user.username = session["username"]
+        self.user.game_summaries = session["game_summaries"]
+        self.sm.current = "user_home"
@@ -0,0 +1,142 @@
+"""Packs the contents of a board into a few dozen bytes.
+
+The layout is fixed, and every field is one byte unless it says otherwise:
+
+* The format version (`FORMAT_VERSION`).
+* How many animals there are. Then for each animal:
+  * Its type id (its position in `ANIMALS`, counting from 1).
+  * Its anchor square (see `square_index`), which is where its (0, 0) segment goes.
+  * Which of its segments are shot, as a bitmask. Bit i is the i-th segment of its `cls_segments`.
+* Every square with a Miss, as a `MASK_BYTES` long bitmask (little endian, bit i is square i).
+* The square of the Photo, or `NO_PHOTO`.
+
+A full board of ten animals is 46 bytes.
+
+Games rows keep the animals and the misses in separate text columns (see `encode_columns`), so reading a row
+brings its boards along, rather than needing a download per board.
+Before that, boards were `encode`d into a media column, and before that they were gzipped pickles of
+`Board.serialize()`. Those always start with the gzip magic bytes, so `decode` can tell them apart, and reads both.
+"""
+import pickle
+from gzip import decompress
+
+from sonora import board_objects
+from sonora.board_objects import (
+    Animal,
+    Bighorn,
+    Bobcat,
+    Centipede,
+    Flycatcher,
+    Gila,
+    Jackrabbit,
+    Javelina,
+    Miss,
+    Photo,
+    Pyrrhuloxia,
+    Ringtail,
+    Snake,
+)
+from sonora.static import COLS
+
+FORMAT_VERSION = 1
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Type ids are positions in here, and they're stored in the tables. Only ever add to the end.
+# For the same reason, the order of each animal's `cls_segments` mustn't change.
+ANIMALS = (Flycatcher, Pyrrhuloxia, Snake, Centipede, Javelina, Ringtail, Bighorn, Bobcat, Gila, Jackrabbit)
+ANIMAL_IDS = {animal_cls: type_id for type_id, animal_cls in enumerate(ANIMALS, start=1)}
+
+ROWS = 10
+SQUARES = ROWS * len(COLS)
+MASK_BYTES = (SQUARES + 7) // 8
+NO_PHOTO = 0xFF
+HEADER_BYTES = 2
+ANIMAL_BYTES = 3
+
+
+def square_index(row, col):
+    """Squares are numbered 0 to 99, across each row, starting from (1, "A")."""
+    return (row - 1) * len(COLS) + COLS.index(col)
+
+
+def square_loc(index):
+    """The inverse of `square_index`."""
+    row, col = divmod(index, len(COLS))
+    return row + 1, COLS[col]
+
+
+def encode(contents):
+    """`Board.contents` as bytes."""
+    animals = bytearray()
+    misses = 0
+    photo = NO_PHOTO
+    for obj in contents:
+        if isinstance(obj, Animal):
+            shot = sum(1 << i for i, seg in enumerate(obj.segments) if seg.shot)
+            animals += bytes((ANIMAL_IDS[type(obj)], square_index(obj.base_row, obj.base_col), shot))
+        elif isinstance(obj, Miss):
+            misses |= 1 << square_index(*obj.loc)
+        elif isinstance(obj, Photo):
+            photo = square_index(*obj.loc)
+        else:
+            raise TypeError(f"Can't encode {obj}.")
+    n_animals = len(animals) // ANIMAL_BYTES
+    return bytes((FORMAT_VERSION, n_animals)) + animals + misses.to_bytes(MASK_BYTES, "little") + bytes((photo,))
+
+
+def decode(data):
+    """The inverse of `encode`, giving new board objects. Also reads boards in the old pickled format."""
+    if data[:2] == GZIP_MAGIC:
+        return decode_pickled(data)
+    if not data or data[0] != FORMAT_VERSION:
+        raise ValueError(f"Unknown board format ({data[:1]}).")
+    n_animals = data[1]
+    misses_at = HEADER_BYTES + n_animals * ANIMAL_BYTES
+    if len(data) != misses_at + MASK_BYTES + 1:
+        raise ValueError(f"A board with {n_animals} animals can't be {len(data)} bytes long.")
+
+    contents = []
+    for at in range(HEADER_BYTES, misses_at, ANIMAL_BYTES):
+        type_id, anchor, shot = data[at : at + ANIMAL_BYTES]
+        animal = ANIMALS[type_id - 1](*square_loc(anchor))
+        for i, seg in enumerate(animal.segments):
+            seg.shot = bool(shot >> i & 1)
+        contents.append(animal)
+    misses = int.from_bytes(data[misses_at : misses_at + MASK_BYTES], "little")
+    while misses:
+        lowest = misses & -misses
+        contents.append(Miss(*square_loc(lowest.bit_length() - 1)))
+        misses ^= lowest
+    photo = data[-1]
+    if photo != NO_PHOTO:
+        contents.append(Photo(*square_loc(photo)))
+    return contents
+
+
+def encode_columns(contents):
+    """`Board.contents` as the (animals, misses) text columns of a games row.
+
+    These are the animals and the miss bitmask from `encode`, in hex. There's no column for the photo,
+    since it's always resolved into a shot or miss before a board gets stored.
+    """
+    data = encode(contents)
+    misses_at = HEADER_BYTES + data[1] * ANIMAL_BYTES
+    return data[HEADER_BYTES:misses_at].hex(), data[misses_at : misses_at + MASK_BYTES].hex()
+
+
+def decode_columns(animals, misses):
+    """The inverse of `encode_columns`."""
+    animals, misses = bytes.fromhex(animals), bytes.fromhex(misses)
+    return decode(bytes((FORMAT_VERSION, len(animals) // ANIMAL_BYTES)) + animals + misses + bytes((NO_PHOTO,)))
+
+
+def decode_pickled(data):
+    """Reads a board written before `encode` existed."""
+    return from_serialized(pickle.loads(decompress(data)))
+
+
+def from_serialized(simple_board):
+    """Board objects from the output of `Board.serialize()` (None for a board that was never set up)."""
+    if simple_board is None:
+        return []
+    return [getattr(board_objects, board_obj["class"]).deserialize(board_obj) for board_obj in simple_board]
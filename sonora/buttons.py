@@ -1,5 +1,8 @@
+import threading
+
 import anvil.server
 import bcrypt
+from kivy.clock import Clock
 from kivy.uix.behaviors import ButtonBehavior
 from kivy.uix.button import Button
 from kivy.uix.image import Image
@@ -17,7 +20,8 @@ from sonora.popups import (
     NextSetupPageConfirmation,
     TakeTurnConfirmation,
 )
-from sonora.static import COLS, SonoraColor
+from sonora.routing import MATCHMAKING_SHARD, call_batch, call_for_pair, call_on_shard
+from sonora.static import COLS, LONG_POLL_TIMEOUT, SonoraColor
 
 
 class OppBoardBtn(Button, ModelUpdater):
@@ -239,10 +243,12 @@ class AnimalButton(ButtonBehavior, Image, ModelUpdater):
 
 
 class ResumeGameBtn(Button, ModelUpdater):
-    def __init__(self, game_row, **kwargs):
+    def __init__(self, game_summary, **kwargs):
         super(ResumeGameBtn, self).__init__(**kwargs)
-        self.game_for_btn = Game(game_row, self.user)  # Don't populate `self.game` quite yet
-        self.text = f"Resume Game with {self.game_for_btn.opponent}.\n" f"(Status: {self.game_for_btn.status.value})\n"
+        # Only the summary is needed to draw the button. The full row (and its boards) are fetched on press.
+        self.game_summary = game_summary
+        self.game_for_btn = None  # Don't populate `self.game` quite yet
+        self.text = f"Resume Game with {game_summary['opponent']}.\n" f"(Status: {game_summary['status']})\n"
         self.background_normal = get_img("mountains_watercolor1.png")
 
     def update_model(self):
@@ -256,10 +262,14 @@ class ResumeGameBtn(Button, ModelUpdater):
         1. Starting up the app and doing a login.
         2. Finishing setup and being navigated back to the user_home screen.
 
-        If
+        Either way, the row is fetched fresh, so the setup status is current.
         """
-        # This seems to be necessary for the case where you end up at user_home from Setup.
-        self.game_for_btn.setup_status = self.game_for_btn.fetch_setup_status()
+        summary = self.game_summary
+        game_row = call_for_pair(summary["player1"], summary["player2"], "get_game", summary["game_id"])
+        if isinstance(game_row, str):
+            ErrorPopup(game_row).open()
+            return
+        self.game_for_btn = Game(game_row, self.user)
 
         if self.game_for_btn.setup_status == SetupStatus.YOU_DONE_OPP_NOT:
             msg = "You've already completed setup.\n" f"Waiting on {self.game_for_btn.opponent} to finish."
@@ -281,8 +291,8 @@ class CreateGameBtn(Button, ModelUpdater):
         self.text = "Create Game"
         self.background_color = SonoraColor.SONORAN_SAGE.value
 
-    def update_model(self, game_row, **kwargs):
-        self.user.game_rows.append(game_row)
+    def update_model(self, game_summary, **kwargs):
+        self.user.game_summaries.append(game_summary)
 
     def on_press(self):
         opponent_name = self.parent.parent.username.text
@@ -292,14 +302,81 @@ class CreateGameBtn(Button, ModelUpdater):
         if self.user.username == opponent_name:
             ErrorPopup(message="You cannot start a game with yourself.").open()
             return
-        row_or_err = anvil.server.call("create_game", self.user.username, opponent_name)
-        if isinstance(row_or_err, str):
-            ErrorPopup(message=row_or_err).open()
+        summary_or_err = call_for_pair(
+            self.user.username, opponent_name, "create_game", self.user.username, opponent_name
+        )
+        if isinstance(summary_or_err, str):
+            ErrorPopup(message=summary_or_err).open()
             return
         logger.info(f"Creating a new game with {opponent_name}")
-        self.update_model(row_or_err)
-        # Important: this line causes the current db row to become the Game
-        ResumeGameBtn(row_or_err).on_press()
+        self.update_model(summary_or_err)
+        # Important: this line causes the new game to become the Game
+        ResumeGameBtn(summary_or_err).on_press()
+
+
+class FindOpponentBtn(Button, ModelUpdater):
+    """Wait in the matchmaking queue for anyone at all to play against. Press again to stop waiting."""
+
+    idle_text = "Find Me an Opponent"
+    searching_text = "Looking for an opponent...\n(Press to stop looking)"
+
+    def __init__(self, **kwargs):
+        super(FindOpponentBtn, self).__init__(**kwargs)
+        self.size_hint = (1, 0.1)
+        self.text = self.idle_text
+        self.background_color = SonoraColor.SONORAN_SAGE.value
+        self.searching = False
+
+    def update_model(self, game_summary, **kwargs):
+        known_game_ids = [summary["game_id"] for summary in self.user.game_summaries]
+        if game_summary["game_id"] not in known_game_ids:  # The poller may have found it first
+            self.user.game_summaries.append(game_summary)
+
+    def on_press(self):
+        if self.searching:
+            self.searching = False
+            self.text = self.idle_text
+            call_on_shard(MATCHMAKING_SHARD, "cancel_find_opponent", self.user.username)
+            return
+        self.searching = True
+        self.text = self.searching_text
+        threading.Thread(target=self.wait_for_opponent, args=(self.user.username,), daemon=True).start()
+
+    def wait_for_opponent(self, username):
+        """Runs on a background thread, since each call blocks for up to `LONG_POLL_TIMEOUT` seconds."""
+        while self.searching:
+            try:
+                result = call_on_shard(MATCHMAKING_SHARD, "find_opponent", username, LONG_POLL_TIMEOUT)
+            except Exception as err:
+                result = f"Couldn't look for an opponent ({err})."
+            if result is not None and self.searching:
+                Clock.schedule_once(lambda _: self.found_opponent(result))
+                return
+
+    def found_opponent(self, summary_or_err):
+        self.searching = False
+        self.text = self.idle_text
+        if isinstance(summary_or_err, str):
+            ErrorPopup(message=summary_or_err).open()
+            return
+        logger.info(f"Matched with {summary_or_err['opponent']}")
+        self.update_model(summary_or_err)
+        # Important: this line causes the new game to become the Game
+        ResumeGameBtn(summary_or_err).on_press()
+
+
+class PlayerSuggestionBtn(Button):
+    """One of the autocomplete suggestions under the username field. Pressing it fills in the field."""
+
+    def __init__(self, username, username_input, **kwargs):
+        super(PlayerSuggestionBtn, self).__init__(**kwargs)
+        self.text = username
+        self.username_input = username_input
+        self.background_color = SonoraColor.TERMINAL_PAPER.value
+        self.color = (0, 0, 0, 1)
+
+    def on_press(self):
+        self.username_input.text = self.text
 
 
 class GotoCreateGameBtn(Button):
@@ -330,8 +407,10 @@ class CreateAccountBtn(Button, ModelUpdater):
         self.text = "Create Account"
         self.background_color = SonoraColor.SONORAN_SAGE.value
 
-    def update_model(self, username):
+    def update_model(self, username, session_token, game_summaries):
+        self.user.session_token = session_token
         self.user.username = username
+        self.user.game_summaries = game_summaries
 
     @staticmethod
     def validate_login(username, password):
@@ -353,12 +432,18 @@ class CreateAccountBtn(Button, ModelUpdater):
         if not self.validate_login(username, password):
             return
         hashed = bcrypt.hashpw(bytes(password, encoding="utf8"), bcrypt.gensalt())
-        row_or_err = anvil.server.call("create_account", username, hashed.decode("utf-8"))
+        # Log straight in, in the same round trip, so the new account gets a session like any other login.
+        row_or_err, session_or_err = call_batch(
+            [("create_account", [username, hashed.decode("utf-8")]), ("login", [username, password])]
+        )
         if isinstance(row_or_err, str):
             ErrorPopup(row_or_err).open()
             return
         logger.info(f"Created new account for {username}")
-        self.update_model(username)
+        if isinstance(session_or_err, str):
+            logger.warning(f"Couldn't start a session for {username}: {session_or_err}")
+            session_or_err = {"token": "", "game_summaries": []}
+        self.update_model(username, session_or_err["token"], session_or_err["game_summaries"])
         switch_to_screen("user_home")
 
 
@@ -379,9 +464,10 @@ class LoginBtn(Button, ModelUpdater):
         self.text = "Login"
         self.background_color = SonoraColor.SONORAN_SAGE.value
 
-    def update_model(self, username, games):
+    def update_model(self, username, session_token, game_summaries):
+        self.user.session_token = session_token
         self.user.username = username
-        self.user.game_rows = games
+        self.user.game_summaries = game_summaries
 
     def get_games(self, username):
         pass
@@ -400,18 +486,15 @@ class LoginBtn(Button, ModelUpdater):
         return True
 
     def login(self, username, password):
-        password = bytes(password, encoding="utf8")
-        pass_hash = anvil.server.call("get_pass_hash", username)
-        correct_pass = bcrypt.checkpw(password, bytes(pass_hash, encoding="utf-8"))
-        if correct_pass:
-            logger.info(f"{username} successfully logged in")
-            games = anvil.server.call("get_incomplete_games", username)
-            logger.info(f"Found {len(games)} games.")
-            self.update_model(username, games)
-            switch_to_screen("user_home")
-        else:
-            msg = f"Oh no! That password isn't correct for {username}."
-            ErrorPopup(msg).open()
+        """The password is checked on the server, which sends back our games in the same round trip."""
+        session_or_err = anvil.server.call("login", username, password)
+        if isinstance(session_or_err, str):
+            ErrorPopup(session_or_err).open()
+            return
+        logger.info(f"{username} successfully logged in")
+        logger.info(f"Found {len(session_or_err['game_summaries'])} games.")
+        self.update_model(username, session_or_err["token"], session_or_err["game_summaries"])
+        switch_to_screen("user_home")
 
     def on_press(self):
         inputs = self.parent.login_input_space
@@ -2,7 +2,7 @@ from kivy.uix.button import Button
 from loguru import logger
 
 from sonora.buttons_dir.updater import ModelUpdater, switch_to_screen
-from sonora.static import SetupStatus, SonoraColor, Status
+from sonora.static import SetupStatus, SonoraColor
 
 
 class ConfirmBtn(Button, ModelUpdater):
@@ -40,16 +40,18 @@ class FinishSetupConfirmBtn(ConfirmBtn, ModelUpdater):
         super(FinishSetupConfirmBtn, self).__init__(**kwargs)
 
     def update_model(self, **kwargs):
-        self.game.board = self.game_setup.board
-        self.game.notify_of_setup_finished()
-        if self.game.setup_status == SetupStatus.COMPLETE:
-            self.game.status = Status.ACTIVE
+        """Returns an error message if the server didn't take the setup."""
+        return self.game.finish_setup(self.game_setup.board)
 
     def on_press(self):
         logger.info("Finalizing setup stage!")
-        self.update_model()
+        err = self.update_model()
         self.dismiss_popup()
-        if self.game.setup_status == SetupStatus.COMPLETE:
+        if err is not None:
+            from sonora.popups import ErrorPopup  # popups imports this module
+
+            ErrorPopup(f"{err}\nPlease try again.").open()
+        elif self.game.setup_status == SetupStatus.COMPLETE:
             switch_to_screen("your_board")
         else:
             switch_to_screen("user_home", "right")
@@ -60,14 +62,17 @@ class TakeTurnConfirmBtn(ConfirmBtn, ModelUpdater):
         super(TakeTurnConfirmBtn, self).__init__(**kwargs)
 
     def update_model(self, **kwargs):
-        self.game.opp_board.photo_to_shot_or_miss()
-        self.game.resolve_full_animal_just_shot()
-        self.game.commit_opp_board(None, self.game.opp_board)
-        if self.game.check_for_win():
+        outcome = self.game.take_turn()
+        if isinstance(outcome, str):
+            from sonora.popups import ErrorPopup  # popups imports this module
+
+            ErrorPopup(outcome).open()
+        elif outcome["won"]:
+            # Careful here. Drop the game before setting winner if you want the user_home screen to look right.
+            game_id = self.game.game_id
+            self.user.game_summaries = [s for s in self.user.game_summaries if s["game_id"] != game_id]
             self.game.set_win_state()
             switch_to_screen("user_home", "right")
-        else:
-            self.game.switch_to_opps_turn()
 
     def on_press(self):
         logger.info("Saving turn.")
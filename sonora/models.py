@@ -1,22 +1,22 @@
-import pickle
-from gzip import compress, decompress
-
-from anvil import BlobMedia
 from kivy.event import EventDispatcher
 from kivy.properties import BooleanProperty, ListProperty, NumericProperty, ObjectProperty, StringProperty
 from loguru import logger
 from more_itertools import only
 
-from sonora import board_objects
+from sonora import board_codec, zobrist
 from sonora.board_objects import Animal, AnimalTypes, Miss, Photo, Square
+from sonora.routing import call_for_pair
 from sonora.static import COLS, SetupStatus, SetupStatusInternal, Status
 
+MAX_COMMIT_ATTEMPTS = 3
+
 
 class User(EventDispatcher):
     """Info about the individual playing on this instance of the app."""
 
     username = StringProperty("")
-    game_rows = ListProperty([])  # These are <LiveObject: anvil.tables.Row>
+    session_token = StringProperty("")
+    game_summaries = ListProperty([])  # These are the flat dicts from the `get_home_snapshot` callable
 
     def on_username(self, arg1, arg2):
         return self.username
@@ -26,6 +26,7 @@ class Board:
     def __init__(self):
         self.grid = self.init_grid()
         self.contents = []
+        self.hash = 0  # See `sonora.zobrist`. Kept up to date by everything that changes `contents`.
 
         self.full_animal_just_shot = None  # Note that Game has same attribute, since it's an EventDispatcher
 
@@ -36,6 +37,7 @@ class Board:
         else:
             self.grid[board_obj.loc].obj = board_obj
         self.contents.append(board_obj)
+        self.hash ^= zobrist.obj_key(board_obj)
         logger.info(f"Added {board_obj} to board.")
 
     def __sub__(self, board_obj):
@@ -45,6 +47,7 @@ class Board:
         else:
             self.grid[board_obj.loc].obj = None
         self.contents.remove(board_obj)
+        self.hash ^= zobrist.obj_key(board_obj)
         logger.info(f"Removed {board_obj} from board.")
 
     @staticmethod
@@ -56,18 +59,41 @@ class Board:
         return grid
 
     @classmethod
-    def deserialize(cls, db_rep):
-        pkl = pickle.loads(decompress(db_rep.get_bytes()))
-        if pkl is None:
-            return cls()
+    def from_row(cls, row, board_col):
+        """Read the board that `row` (a games row, or a dict of its columns) keeps under `board_col`.
 
-        new = cls()
+        That's "player1_board" or "player2_board". The board itself is in the plain columns from `to_cols`,
+        apart from rows written before those existed, which still have it in the `board_col` media column.
+        """
+        animals = row[f"{board_col}_animals"]
+        if animals is None:
+            return cls.deserialize(row[board_col])
+        return cls.from_contents(board_codec.decode_columns(animals, row[f"{board_col}_misses"]))
+
+    def to_cols(self, board_col):
+        """The columns of a games row that store this board as `board_col`. The inverse of `from_row`.
+
+        Alongside the board itself are its hash, and how many animal segments are left to be shot,
+        so the server can answer questions about a board without reading it.
+        """
+        animals, misses = board_codec.encode_columns(self.contents)
+        return {
+            f"{board_col}_animals": animals,
+            f"{board_col}_misses": misses,
+            f"{board_col}_hash": zobrist.to_text(self.hash),
+            f"{board_col}_left": self.segments_left(),
+        }
 
-        def find_cls(board_obj):
-            return getattr(board_objects, board_obj["class"])
+    @classmethod
+    def deserialize(cls, db_rep):
+        """Reads a board from a media column. Both `board_codec` boards and the old pickled ones."""
+        return cls.from_contents(board_codec.decode(db_rep.get_bytes()))
 
-        contents = [find_cls(board_obj).deserialize(board_obj) for board_obj in pkl]
+    @classmethod
+    def from_contents(cls, contents):
+        new = cls()
         setattr(new, "contents", contents)
+        new.hash = zobrist.board_hash(contents)
 
         for board_obj in contents:
             if hasattr(board_obj, "segments"):
@@ -94,6 +120,14 @@ class Board:
         else:
             self - existing
 
+    def segments_left(self):
+        """How many animal segments haven't been shot yet."""
+        return sum(not seg.shot for obj in self.contents if isinstance(obj, Animal) for seg in obj.segments)
+
+    def all_animals_shot(self):
+        """Returns True if all Animals have been shot."""
+        return all(animal.shot for animal in self.contents if issubclass(type(animal), Animal))
+
     def set_full_animal_shot(self, seg):
         """This gets triggered immediately after an animal is shot and will be consumed by the Game
 
@@ -131,9 +165,25 @@ class Board:
             self + Miss(*photo.loc)
         else:
             match.shot = True
+            self.hash ^= zobrist.shot_key(match.loc)
             self.grid[photo.loc].obj = match
             self.set_full_animal_shot(match)
 
+    def apply_shot(self, row, col, hit):
+        """Apply a move that has already been resolved (by the server), without placing a photo first.
+
+        Squares that have already been resolved are left alone, so the same move can be applied twice.
+        """
+        existing = self.grid[(row, col)].obj
+        if isinstance(existing, Miss) or getattr(existing, "shot", False):
+            return
+        if not hit:
+            self + Miss(row, col)
+            return
+        new_seg = type(existing)(row, col)
+        new_seg.shot = True
+        self.perform_surgery(new_seg, existing)
+
     def perform_surgery(self, new_seg, og_seg):
         """Update an animal that was shot on opps turn.
 
@@ -143,8 +193,26 @@ class Board:
         """
         animal = og_seg.animal_backref(self)
         animal.segments = [new_seg if s.loc == new_seg.loc else s for s in animal.segments]
+        if new_seg.shot != og_seg.shot:
+            self.hash ^= zobrist.shot_key(new_seg.loc)
         self.grid[new_seg.loc].obj = new_seg
 
+    def sync_to(self, other):
+        """Take on the contents of `other` (a copy of this board from the server) without replacing this Board.
+
+        Only squares that differ are changed, so only their views get redrawn.
+        """
+
+        def state(obj):
+            return type(obj), getattr(obj, "shot", False)
+
+        for loc, square in self.grid.items():
+            theirs = other.grid[loc].obj
+            if state(square.obj) != state(theirs):
+                square.obj = theirs
+        self.contents = other.contents
+        self.hash = other.hash
+
 
 class GameSetup(EventDispatcher):
 
@@ -179,6 +247,7 @@ class Game(EventDispatcher):
     status = ObjectProperty()
     your_turn = BooleanProperty(defaultvalue=None)
     winner = StringProperty()
+    version = NumericProperty(0)  # Bumped by the server on every write to the game row
     full_animal_just_shot = ObjectProperty(defaultvalue=None, allownone=True)
 
     def __init__(self, db_rep=None, user=None, **kwargs):
@@ -190,110 +259,236 @@ class Game(EventDispatcher):
                 return
             err_msg = "Only the initial/global instance is allowed to be unpopulated on instantiation."
             raise ValueError(err_msg)
+        # The global instance gets populated again for every game. Loading one mustn't commit anything.
+        self.unbind(board=self.commit_board)
+        self.unbind(setup_status=self.commit_setup_status)
+        self.unbind(status=self.commit_status)
+
         self.db_rep = db_rep
+        self.game_id = db_rep["game_id"]
+        self.version = db_rep["version"]
         self.your_name = user.username
-        self.you_are_p1 = db_rep["player1"]["username"] == user.username
-        self.opponent = (db_rep["player2"] if self.you_are_p1 else db_rep["player1"])["username"]
+        self.session_token = user.session_token  # The server checks it's your turn by your session
+        self.you_are_p1 = db_rep["player1"] == user.username
+        self.opponent = db_rep["player2"] if self.you_are_p1 else db_rep["player1"]
         self.your_board_col_label = "player1_board" if self.you_are_p1 else "player2_board"
         self.opp_board_col_label = "player2_board" if self.you_are_p1 else "player1_board"
-        self.board = Board.deserialize(db_rep[self.your_board_col_label])
-        self.opp_board = Board.deserialize(db_rep[self.opp_board_col_label])
+        self.board, self.opp_board = self.load_boards(db_rep)
+        self.new_moves = []  # Fetched by the poller when the opponent finishes a turn
+        self.remote_board_hashes = {}  # As of `new_moves`
+        self.commit_error = None  # From the last commit that failed. Commits made through bindings can't return it.
+        self.db_setup_status = db_rep["setup_status"]  # As of `version`. Kept up to date by our own commits.
+        self.db_status = db_rep["status"]  # Likewise
         self.setup_status = self.fetch_setup_status()
         self.status = Status[self.db_rep["status"]]
-        self.your_turn = self.db_rep["turn"]["username"] == user.username
+        self.your_turn = self.db_rep["turn"] == user.username
 
-        self.bind(board=self.commit_board)
-        self.bind(opp_board=self.commit_opp_board)
+        self.bind(board=self.commit_board)  # The opponent's board is only ever written by the server, on their turns
         self.bind(setup_status=self.commit_setup_status)
         self.bind(status=self.commit_status)
 
+    def load_boards(self, db_rep):
+        """Your board and your opponent's, as of the last move in `db_rep` (from the `get_game` callable)."""
+        board = Board.from_row(db_rep, self.your_board_col_label)
+        opp_board = Board.from_row(db_rep, self.opp_board_col_label)
+        for shooter, row, col, hit, _ in db_rep["moves"]:
+            (board if shooter == self.opponent else opp_board).apply_shot(row, col, hit)
+        return board, opp_board
+
     def fetch_setup_status(self):
-        if self.db_rep["setup_status"] == SetupStatus.NEITHER.value:
+        if self.db_setup_status == SetupStatus.NEITHER.value:
             return SetupStatus.NEITHER
-        if self.db_rep["setup_status"] == SetupStatus.COMPLETE.value:
+        if self.db_setup_status == SetupStatus.COMPLETE.value:
             return SetupStatus.COMPLETE
         just_you_done = (
-            self.db_rep["setup_status"] == SetupStatusInternal.PLAYER1_DONE.value
+            self.db_setup_status == SetupStatusInternal.PLAYER1_DONE.value
             and self.you_are_p1
-            or self.db_rep["setup_status"] == SetupStatusInternal.PLAYER2_DONE.value
+            or self.db_setup_status == SetupStatusInternal.PLAYER2_DONE.value
             and not self.you_are_p1
         )
         if just_you_done:
             return SetupStatus.YOU_DONE_OPP_NOT
         return SetupStatus.OPP_DONE_YOU_NOT
 
+    def commit(self, resolve_conflict=None, **cols):
+        """Write columns to the game row through the server, so that the version gets bumped.
+
+        The write only happens if the game is still at the version we last saw.
+        If the opponent wrote in the meantime, we take on the state they left the game in,
+        and then `resolve_conflict()` decides what to write instead (or returns None to write nothing).
+        Without `resolve_conflict`, the same columns are written again,
+        which is only right for columns that nobody else writes to, like `status` once setup is complete.
+
+        Returns an error message if the server couldn't take the write, and keeps it in `commit_error`.
+        """
+        for _ in range(MAX_COMMIT_ATTEMPTS):
+            result = call_for_pair(
+                self.your_name,
+                self.opponent,
+                "update_game",
+                self.session_token,
+                self.game_id,
+                expected_version=self.version,
+                **cols,
+            )
+            if isinstance(result, str):
+                logger.warning(f"Couldn't commit {list(cols)}: {result}")
+                self.commit_error = result
+                return result
+            if not isinstance(result, dict):
+                self.version = result
+                self.db_setup_status = cols.get("setup_status", self.db_setup_status)
+                self.db_status = cols.get("status", self.db_status)
+                return None
+            logger.info(f"The game changed before we could commit {list(cols)}. Retrying.")
+            self.version = result["version"]
+            self.db_setup_status = result["setup_status"]
+            self.db_status = result["status"]
+            if resolve_conflict is not None:
+                cols = resolve_conflict()
+                if cols is None:
+                    return None
+        msg = f"Couldn't commit {list(cols)}, since the game kept changing."
+        logger.warning(msg)
+        self.commit_error = msg
+        return msg
+
     def _commit_either_board(self, board, col_label):
         """Private func to save board after which column to save to has been sorted out."""
         logger.info("Committing board:")
-        simple_board = board.serialize()
-        logger.info(str(simple_board))
-        self.db_rep[col_label] = BlobMedia("text/plain", compress(pickle.dumps(simple_board)))
+        cols = board.to_cols(col_label)
+        return self.commit(resolve_conflict=lambda: self.resolve_board_conflict(cols), **cols)
 
-    def commit_board(self, _, board):
-        self._commit_either_board(board, self.your_board_col_label)
+    def resolve_board_conflict(self, cols):
+        """Boards only get committed from here during setup. After that, the server writes them (as keyframes),
+        so writing ours again could undo a turn."""
+        return cols if self.db_status == Status.SETUP.value else None
 
-    def commit_opp_board(self, _, opp_board):
-        self._commit_either_board(opp_board, self.opp_board_col_label)
+    def commit_board(self, _, board):
+        return self._commit_either_board(board, self.your_board_col_label)
 
     def commit_status(self, _, status):
-        self.db_rep["status"] = status.value
-
-    def commit_winner(self):
-        """This only gets called if you are the winner."""
-        self.db_rep["winner"] = self.db_rep["player1"] if self.you_are_p1 else self.db_rep["player2"]
+        return self.commit(status=status.value)
 
-    def commit_setup_status(self, _, setup_status):
+    def setup_status_cols(self, setup_status):
         if setup_status == SetupStatus.YOU_DONE_OPP_NOT and self.you_are_p1:
-            self.db_rep["setup_status"] = SetupStatusInternal.PLAYER1_DONE.value
+            return {"setup_status": SetupStatusInternal.PLAYER1_DONE.value}
         elif setup_status == SetupStatus.YOU_DONE_OPP_NOT and not self.you_are_p1:
-            self.db_rep["setup_status"] = SetupStatusInternal.PLAYER2_DONE.value
+            return {"setup_status": SetupStatusInternal.PLAYER2_DONE.value}
         elif setup_status == SetupStatus.COMPLETE:
-            self.db_rep["setup_status"] = SetupStatus.COMPLETE.value
+            return {"setup_status": SetupStatus.COMPLETE.value}
         else:
-            ValueError(f"{setup_status} is not in a valid state at this time.")
+            return None  # Only the statuses you can move the game into get committed
 
-    def switch_to_opps_turn(self):
-        self.db_rep["turn"] = self.db_rep["player2"] if self.you_are_p1 else self.db_rep["player1"]
+    def commit_setup_status(self, _, setup_status):
+        cols = self.setup_status_cols(setup_status)
+        if cols is not None:
+            return self.commit(resolve_conflict=self.resolve_setup_conflict, **cols)
+        return None
+
+    def resolve_setup_conflict(self):
+        """The opponent wrote first, probably because they finished setup too. Work out our status from theirs."""
+        setup_status = self.finished_setup_status()
+        if setup_status == self.setup_status:
+            return self.setup_status_cols(setup_status)
+        self.setup_status = setup_status  # Commits, through `commit_setup_status`
+        return None
+
+    def take_turn(self):
+        """Send your photo to the server, which resolves the entire turn in one go.
+
+        The server does the same `photo_to_shot_or_miss` that we do here,
+        so the local opp_board just has to follow along. Nothing else gets committed from the client.
+        Returns the outcome of the turn, or an error message if the server refused it.
+        """
+        photo = only((a for a in self.opp_board.contents if isinstance(a, Photo)))
+        outcome = call_for_pair(
+            self.your_name, self.opponent, "take_turn", self.session_token, self.game_id, *photo.loc
+        )
+        if isinstance(outcome, str):
+            return outcome
+        self.version = outcome["version"]
+        self.opp_board.photo_to_shot_or_miss()
+        self.resolve_full_animal_just_shot()
         self.your_turn = False
+        return outcome
+
+    def finish_setup(self, board):
+        """Commit your finished board, then that you've finished setup (and that the game has started, if it has).
+
+        Returns an error message if the server didn't take any of those. If it didn't take the board,
+        setup isn't marked as finished, so pressing the button again just tries again.
+        """
+        self.commit_error = None
+        if board is self.board:
+            self.commit_board(self, board)  # Setting the same board again wouldn't commit it
+        else:
+            self.board = board  # Commits, through `commit_board`
+        if self.commit_error is not None:
+            return self.commit_error
+        self.notify_of_setup_finished()
+        if self.commit_error is not None:
+            self.setup_status = self.fetch_setup_status()  # Back to what the server has. Commits nothing.
+            return self.commit_error
+        if self.setup_status == SetupStatus.COMPLETE:
+            self.status = Status.ACTIVE
+        return self.commit_error
 
     def notify_of_setup_finished(self):
-        fresh_setup_status = self.fetch_setup_status()  # in case your opp finished while you were messing around
-        if fresh_setup_status == SetupStatus.NEITHER:
-            self.setup_status = SetupStatus.YOU_DONE_OPP_NOT
-        elif fresh_setup_status == SetupStatus.OPP_DONE_YOU_NOT:
-            self.setup_status = SetupStatus.COMPLETE
+        """No need to re-fetch the game first: if your opp finished while you were messing around,
+        the commit conflicts, and `resolve_setup_conflict` sorts it out."""
+        self.setup_status = self.finished_setup_status()
+
+    def finished_setup_status(self):
+        """What the setup status becomes once you've finished, given the last status we know of."""
+        setup_status = self.fetch_setup_status()
+        if setup_status in (SetupStatus.NEITHER, SetupStatus.YOU_DONE_OPP_NOT):
+            return SetupStatus.YOU_DONE_OPP_NOT
+        elif setup_status in (SetupStatus.OPP_DONE_YOU_NOT, SetupStatus.COMPLETE):
+            return SetupStatus.COMPLETE
         else:
-            raise ValueError(f"{fresh_setup_status} is not a valid setup status.")
+            raise ValueError(f"{setup_status} is not a valid setup status.")
 
     def resolve_turn_updates(self, arg1, polled_opp_finish_turn):
         """Called when your opp finishes a turn.
 
         Note: it already been verified that they haven't won.
-        At this point, the only thing left to do is to deserialize your new board.
-        This takes a little bit of effort because we need to make sure the correct view is applied to your board.
-        We hunt down what changed, and update that square.
-        There are only two possibilities:
+        At this point, the only thing left to do is to apply their move (fetched by the poller) to your board.
+        There are only two possibilities, and `Board.apply_shot` makes sure the view of the square gets updated:
 
         1. A hit
         2. A miss
         """
         if not polled_opp_finish_turn:
             return
-        new_board = Board.deserialize(self.db_rep[self.your_board_col_label])
-        for obj in new_board.contents[::-1]:  # Most likely case is a miss
-            if hasattr(obj, "segments"):
-                for seg in obj.segments:
-                    if not seg.shot:
-                        continue
-                    og_seg = self.board.grid[seg.loc].obj
-                    if not og_seg.shot:
-                        self.board.perform_surgery(seg, og_seg)
-                        break
-            else:
-                is_new_obj = self.board.grid[obj.loc].obj is None
-                if is_new_obj:
-                    self.board + obj
-                    break
+        self.apply_moves(self.new_moves)
+        self.new_moves = []
+        self.verify_boards(self.remote_board_hashes)
+
+    def apply_moves(self, moves):
+        """Apply [shooter, row, col, hit, version] moves from the server to whichever board they were made against."""
+        for shooter, row, col, hit, _ in moves:
+            board = self.board if shooter == self.opponent else self.opp_board
+            board.apply_shot(row, col, hit)
+
+    def verify_boards(self, board_hashes):
+        """Check our boards against the server's hashes of them (by column). If either has drifted, reload both.
+
+        The opponent's board is skipped while it has a photo on it, since the server never sees that.
+        """
+        ours = {self.your_board_col_label: self.board}
+        if only((a for a in self.opp_board.contents if isinstance(a, Photo))) is None:
+            ours[self.opp_board_col_label] = self.opp_board
+        if all(board_hashes.get(col) in (None, zobrist.to_text(board.hash)) for col, board in ours.items()):
+            return
+        logger.warning("Our boards don't match the server's. Reloading them.")
+        db_rep = call_for_pair(self.your_name, self.opponent, "get_game", self.game_id)
+        if isinstance(db_rep, str):
+            logger.warning(db_rep)
+            return
+        board, opp_board = self.load_boards(db_rep)
+        self.board.sync_to(board)
+        self.opp_board.sync_to(opp_board)
 
     def resolve_full_animal_just_shot(self):
         """If the last segment in an animal is shot, we need to notify the board view to update other squares."""
@@ -304,16 +499,6 @@ class Game(EventDispatcher):
             self.full_animal_just_shot = None
             self.opp_board.full_animal_just_shot = None
 
-    def check_for_win(self):
-        """Returns True if all Animals have been shot.
-
-        Call this right after you take a turn, so we just need to check the opp_board.
-        """
-        return all(animal.shot for animal in self.opp_board.contents if issubclass(type(animal), Animal))
-
     def set_win_state(self):
-        # Careful here. You have to set status before setting winner if you want the user_home screen to look right.
-        self.commit_status(None, Status.COMPLETE)
+        """The server has already recorded the win by the time this gets called, so this is just local state."""
         self.winner = self.your_name
-        self.commit_winner()
-        self.db_rep["turn"] = None
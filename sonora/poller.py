@@ -1,4 +1,11 @@
-"""Keeps tabs on updates from the db on a regular cadence. Updates the models as needed."""
+"""Keeps tabs on updates from the db. Updates the models as needed.
+
+If the server supports it, a background thread long-polls `wait_for_change`, and we only look at the db when told to.
+Otherwise, we fall back to checking on a regular cadence.
+"""
+import threading
+import time
+
 import anvil
 from kivy.app import App
 from kivy.clock import Clock
@@ -6,6 +13,9 @@ from kivy.event import EventDispatcher
 from kivy.properties import BooleanProperty, StringProperty
 from loguru import logger
 
+from sonora.routing import call_batch, call_for_pair
+from sonora.static import LONG_POLL_TIMEOUT
+
 
 class DBPoll(EventDispatcher):
     """Methods in this class can directly update the model."""
@@ -13,85 +23,163 @@ class DBPoll(EventDispatcher):
     # We want to be able to announce a winner from some game
     winner = StringProperty()
     polled_opp_finish_turn = BooleanProperty(defaultvalue=False)
+    home_screen_stale = BooleanProperty(defaultvalue=False)
 
     def __init__(self, game, user, **kwargs):
         super(DBPoll, self).__init__(**kwargs)
         self.game = game
         self.user = user
 
-        Clock.schedule_interval(self.fetch_turn_updates, 3)
-        Clock.schedule_interval(self.scan_for_state_transitions_on_home_screen, 5)
-        Clock.schedule_interval(self.scan_for_new_games_on_home_screen, 5)
-
+        self.user.bind(username=self.start_long_poll)
         self.bind(polled_opp_finish_turn=self.game.resolve_turn_updates)
 
-    def handle_win(self):
+    def start_long_poll(self, _, username):
+        thread = threading.Thread(target=self.long_poll, args=(username,), daemon=True)
+        thread.start()
+
+    def long_poll(self, username):
+        """Runs on a background thread, since each call blocks for up to `LONG_POLL_TIMEOUT` seconds.
+
+        The actual work of checking for updates is handed back to the Kivy thread.
+        """
+        seen_seq = None
+        while self.user.username == username:
+            try:
+                new_seq = anvil.server.call("wait_for_change", username, seen_seq, LONG_POLL_TIMEOUT)
+            except anvil.server.NoServerFunctionError:
+                logger.info("Server doesn't support long polling. Falling back to polling on an interval.")
+                Clock.schedule_once(self.start_interval_polling)
+                return
+            except Exception as err:  # Keep the thread alive through dropped connections and the like
+                logger.warning(f"Long poll failed ({err}). Retrying shortly.")
+                time.sleep(LONG_POLL_TIMEOUT / 4)
+                continue
+            if seen_seq is not None and new_seq != seen_seq:
+                Clock.schedule_once(self.check_for_updates)
+            seen_seq = new_seq
+
+    def start_interval_polling(self, arg1):
+        Clock.schedule_interval(self.fetch_turn_updates, 3)
+        Clock.schedule_interval(self.scan_home_screen, 5)
+
+    def check_for_updates(self, arg1):
+        """Both checks, in a single round trip."""
+        calls, handlers, pair = [], [], None
+        if self.wants_turn_update():
+            calls.append(("get_game_version", [self.game.game_id]))
+            handlers.append(self.apply_turn_update)
+            # get_game_version has to go to the game's shard. The home snapshot doesn't mind where it goes.
+            pair = (self.game.your_name, self.game.opponent)
+        if self.wants_home_snapshot():
+            calls.append(("get_home_snapshot", [self.user.username, self.known_game_ids()]))
+            handlers.append(self.apply_home_snapshot)
+        if not calls:
+            return
+        for handle, result in zip(handlers, call_batch(calls, pair)):
+            handle(result)
+
+    def handle_win(self, winner):
         """Do some sanity checking, then notify everything that there's been a win."""
-        winner = self.game.db_rep["winner"]
         if winner is None:
             raise ValueError("It should never be nobody's turn but there isn't a winner. Tell Jessime.")
-        self.game.winner = winner["username"]
+        self.game.winner = winner
 
     def fetch_turn_updates(self, arg1):
-        """If it isn't your turn, poll to see if it has become your turn.
+        if self.wants_turn_update():
+            version_or_err = call_for_pair(
+                self.game.your_name, self.game.opponent, "get_game_version", self.game.game_id
+            )
+            self.apply_turn_update(version_or_err)
+
+    def wants_turn_update(self):
+        """Only worth asking about the game if there is one, and it isn't your turn."""
+        empty_game = self.game.db_rep is None
+        return not empty_game and not self.game.your_turn
+
+    def apply_turn_update(self, version_or_err):
+        """See if it has become your turn.
+
+        Only the version of the game is polled. Once the version shows that the opponent has taken their turn,
+        just the moves since our version are fetched, rather than the whole row and its boards.
 
         Notes:
             1. This func has a lot of early exits.
             2. This func is bound to a popup that shows on any screen.
         """
-        empty_game = self.game.db_rep is None
-        if empty_game:
+        if isinstance(version_or_err, str):  # The server is busy. We'll catch up next time.
+            logger.info(version_or_err)
             return
-        if self.game.your_turn:
+        version, turn, winner = version_or_err
+        if version == self.game.version:
             return
-        self.game.db_rep.update()
-        fresh_turn = self.game.db_rep["turn"]
-        game_over = fresh_turn is None
+        game_over = turn is None
 
         if game_over:
-            self.handle_win()
+            self.game.version = version
+            self.handle_win(winner)
             return
 
-        self.polled_opp_finish_turn = fresh_turn["username"] == self.game.your_name
+        polled_opp_finish_turn = turn == self.game.your_name
+        if polled_opp_finish_turn:
+            moves = call_for_pair(
+                self.game.your_name, self.game.opponent, "get_moves", self.game.game_id, self.game.version
+            )
+            if isinstance(moves, str):  # Keep our version, so we ask for these moves again next time
+                logger.info(moves)
+                return
+            self.game.new_moves.extend(moves["moves"])
+            self.game.remote_board_hashes = moves["board_hashes"]
+        self.game.version = version
+        # Our own turn never shows up here (we already have its version), so the flag would otherwise still be True
+        # from the opponent's last turn, and setting it to True again wouldn't dispatch.
+        self.polled_opp_finish_turn = False
+        self.polled_opp_finish_turn = polled_opp_finish_turn
         self.game.your_turn = self.polled_opp_finish_turn
 
-    def scan_for_state_transitions_on_home_screen(self, arg1):
-        """If sitting on the home screen, poll for state changes.
+    def scan_home_screen(self, arg1):
+        if self.wants_home_snapshot():
+            snapshot = anvil.server.call("get_home_snapshot", self.user.username, self.known_game_ids())
+            self.apply_home_snapshot(snapshot)
 
-        This checks for two transitions:
+    def wants_home_snapshot(self):
+        """Only while sitting on the home screen.
 
-        1. SETUP -> ACTIVE
-        2. ACTIVE -> COMPLETE
-
-        Note: this was originally more complicated, but why not just always refresh?
-        The game has nothing else going on.
+        If we aren't on the home screen, remember to do the scan once we get there.
         """
         if App.get_running_app().sm.current_screen.name != "user_home":
-            return
+            self.home_screen_stale = True
+            return False
+        self.home_screen_stale = False
+        return True
 
-        remainder = []
-        for db_rep in self.user.game_rows:
-            db_rep.update()
-            winner = db_rep["winner"]
-            if winner is not None:
-                self.winner = winner["username"]
-            else:
-                remainder.append(db_rep)
+    def known_game_ids(self):
+        return [summary["game_id"] for summary in self.user.game_summaries]
 
-        self.user.game_rows = []
-        self.user.game_rows = remainder
+    def apply_home_snapshot(self, snapshot):
+        """A single `get_home_snapshot` call covers three things:
 
-    def scan_for_new_games_on_home_screen(self, arg1):
-        """If sitting on the home screen, look for new games"""
-        if App.get_running_app().sm.current_screen.name != "user_home":
+        1. New games created by an opponent
+        2. SETUP -> ACTIVE
+        3. ACTIVE -> COMPLETE
+
+        Note: the snapshot also includes the games we already know about, even if they've finished,
+        so that we can find out who won them.
+        """
+        if isinstance(snapshot, str):
+            logger.info(snapshot)
+            self.home_screen_stale = True
             return
 
-        def get_usernames(row):
-            return frozenset((row["player1"]["username"], row["player2"]["username"]))
+        known_game_ids = self.known_game_ids()
+        remainder = []
+        for summary in snapshot:
+            if summary["winner"] is not None:
+                self.winner = summary["winner"]
+            else:
+                remainder.append(summary)
 
-        current_games = {get_usernames(row) for row in self.user.game_rows}
-        db_games = anvil.server.call("get_incomplete_games", self.user.username)
-        new_games = [g for g in db_games if get_usernames(g) not in current_games]
+        new_games = [summary for summary in remainder if summary["game_id"] not in known_game_ids]
         if new_games:
-            logger.info(f"Found {len(new_games)} in db. Adding to games_rows.")
-            self.user.game_rows.extend(new_games)
+            logger.info(f"Found {len(new_games)} new games in db.")
+        self.user.game_summaries = []
+        self.user.game_summaries = remainder
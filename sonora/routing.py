@@ -0,0 +1,82 @@
+"""Sends each game's calls to the server process that owns it.
+
+The server can run as several processes (shards), each owning the games of some pairs of players.
+A game always lives on the shard picked by hashing its pair of players, so it can be routed
+before it even exists (when it's being created). Everything that isn't about one game can go to any shard.
+
+Matchmaking has to happen in one place, so it always goes to `MATCHMAKING_SHARD`.
+
+Several calls can also be sent in a single round trip with `call_batch`.
+"""
+import zlib
+
+import anvil.server
+from loguru import logger
+
+MATCHMAKING_SHARD = 0
+
+_shard_count = None
+
+
+def pair_key(username, opponent_name):
+    """The same for a pair of players, no matter who challenged who."""
+    return "|".join(sorted((username, opponent_name)))
+
+
+def shard_for(key, shard_count):
+    """Has to be the same in every process, which rules out the builtin `hash`."""
+    return zlib.crc32(key.encode("utf-8")) % shard_count
+
+
+def shard_name(name, shard):
+    """What a callable is registered as on a particular shard."""
+    return f"{name}__shard{shard}"
+
+
+def shard_count():
+    """Asked for once, then remembered. A server from before sharding counts as one shard."""
+    global _shard_count
+    if _shard_count is None:
+        try:
+            _shard_count = anvil.server.call("get_shard_count")
+        except anvil.server.NoServerFunctionError:
+            _shard_count = 1
+    return _shard_count
+
+
+def call_on_shard(shard, name, *args, **kwargs):
+    """Like `anvil.server.call`, but to a particular shard."""
+    if shard_count() == 1:
+        return anvil.server.call(name, *args, **kwargs)
+    return anvil.server.call(shard_name(name, shard), *args, **kwargs)
+
+
+def call_for_pair(username, opponent_name, name, *args, **kwargs):
+    """Like `anvil.server.call`, but to the shard that owns games between these two players."""
+    shard = shard_for(pair_key(username, opponent_name), shard_count())
+    return call_on_shard(shard, name, *args, **kwargs)
+
+
+def call_batch(calls, pair=None):
+    """Make several calls in one round trip, returning their results in order.
+
+    `calls` is a list of (callable name, args) or (callable name, args, kwargs).
+    If any of them are about one game, pass its `pair` of players, so the batch goes to the shard that owns it.
+    A call that fails on the server gives back its error message instead of a result,
+    the same as callables that return an error message themselves.
+    """
+    try:
+        if pair is None:
+            entries = anvil.server.call("batch", calls)
+        else:
+            entries = call_for_pair(*pair, "batch", calls)
+    except anvil.server.NoServerFunctionError:  # A server from before batching
+        return [anvil.server.call(name, *args, **(kwargs[0] if kwargs else {})) for name, args, *kwargs in calls]
+    results = []
+    for (name, *_), entry in zip(calls, entries):
+        if "error" in entry:
+            logger.warning(f"{name} failed in a batch: {entry['error']}")
+            results.append(entry["error"])
+        else:
+            results.append(entry["result"])
+    return results
@@ -1,67 +1,684 @@
 import os
-import pickle
-from gzip import compress
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from random import choice
 
-import anvil.server
-import anvil.tables.query as q
-from anvil import BlobMedia
-from anvil.tables import app_tables
+import bcrypt
 
-from sonora.static import SetupStatus, Status
+from sonora import zobrist
+from sonora.board_codec import ROWS
+from sonora.board_objects import Miss, Photo, Segment
+from sonora.models import Board
+from sonora.routing import MATCHMAKING_SHARD, pair_key
+from sonora.server_dir.archive import archive_game, start_purging, summarize_archived_game
+from sonora.server_dir.backend import app_tables, in_transaction, order_by, q
+from sonora.server_dir.cache import LRUCache
+from sonora.server_dir.matchmaking import Matchmaker
+from sonora.server_dir.metrics import metrics
+from sonora.server_dir.move_log import add_move, moves_after, moves_since_keyframe
+from sonora.server_dir.notifier import ChangeNotifier
+from sonora.server_dir.player_index import PrefixIndex
+from sonora.server_dir.registry import callables, pool, register
+from sonora.server_dir.shards import SHARD, SHARD_COUNT, ChangeFeed
+from sonora.server_dir.singleflight import flights
+from sonora.static import COLS, LONG_POLL_TIMEOUT, SetupStatus, SetupStatusInternal, Status
 
-anvil.server.connect(os.environ["SONORA_UPLINK_KEY"])
+notifier = ChangeNotifier()
+player_index = PrefixIndex(lambda: [user["username"] for user in app_tables.users.search(enabled=True)])
+user_cache = LRUCache(maxsize=int(os.environ.get("SONORA_USER_CACHE_SIZE", 1000)))
+# Answers to the reads that clients poll. Every write that could change one invalidates it (through `changes`),
+# and the TTL is only a safety net, in case one is ever missed.
+result_cache = LRUCache(
+    maxsize=int(os.environ.get("SONORA_RESULT_CACHE_SIZE", 5000)),
+    ttl=float(os.environ.get("SONORA_RESULT_CACHE_TTL", 60)),
+)
+# bcrypt is deliberately slow, so cap how many checks can eat CPU at once.
+password_checker = ThreadPoolExecutor(max_workers=int(os.environ.get("SONORA_BCRYPT_WORKERS", 4)))
+SESSION_LIFETIME = timedelta(days=30)
+SEARCH_PAGE_SIZE = 10
+HISTORY_PAGE_SIZE = 20
+# A turn only adds a row to the moves table. The boards themselves are rewritten (as keyframes) every this many moves.
+KEYFRAME_INTERVAL = int(os.environ.get("SONORA_KEYFRAME_INTERVAL", 10))
+BOARD_COLS = ("player1_board", "player2_board")
 
 
-@anvil.server.callable
+def forget_game(game_id):
+    """Something about the game changed. Published for every write to a game."""
+    result_cache.invalidate(("game_version", game_id))
+
+
+def announce_change(username):
+    """One of the user's games changed, or they have a new one.
+
+    Reads that start from here on see the change, then anyone waiting on `username` is woken.
+    """
+    flights.invalidate()
+    result_cache.invalidate(("active_games", username))
+    result_cache.invalidate_matching(lambda key: key[:2] == ("home_snapshot", username))
+    notifier.notify(username)
+
+
+def forget_user(username):
+    """The user was added or changed."""
+    user_cache.invalidate(username)
+    result_cache.invalidate(("people",))
+    user = get_user(username)
+    if user is not None and user["enabled"]:
+        player_index.add(username)
+    else:
+        player_index.remove(username)
+
+
+# Wakes long polls and invalidates caches, on every shard.
+changes = ChangeFeed(app_tables.changes, q, {"game": forget_game, "notify": announce_change, "user": forget_user})
+changes.start()
+
+# Only one shard needs to do this.
+if SHARD == 0:
+    start_purging(
+        app_tables,
+        q,
+        interval=float(os.environ.get("SONORA_ARCHIVE_PURGE_INTERVAL", 600)),
+        grace=float(os.environ.get("SONORA_ARCHIVE_GRACE", 3600)),
+    )
+
+if os.environ.get("SONORA_METRICS_FILE"):
+    metrics.start_dumping(os.environ["SONORA_METRICS_FILE"], int(os.environ.get("SONORA_METRICS_INTERVAL", 60)))
+
+
+def get_user(username):
+    """Every callable should look up users through here, so hot users don't cost a table query.
+
+    Note: a missing user is cached as None, which is why account creation has to invalidate.
+    """
+    return user_cache.get_or_load(username, lambda name: app_tables.users.get(username=name))
+
+
+@register(coalesced=True)
 def get_people():
-    people = []
-    for person in app_tables.users.search():
-        people.append(person["email"])
-    return people
+    return result_cache.get_or_load(("people",), lambda _: [person["email"] for person in app_tables.users.search()])
 
 
-@anvil.server.callable
+@register
 def username_available(username):
-    return app_tables.users.get(username=username) is None
+    return get_user(username) is None
 
 
-@anvil.server.callable
+@register
 def create_account(username, hashed):
     if username_available(username):
-        return app_tables.users.add_row(username=username, password_hash=hashed, enabled=True)
+        user = app_tables.users.add_row(username=username, password_hash=hashed, enabled=True)
+        # Adds them to `player_index` on every shard. Other shards may also have cached None for this username.
+        changes.publish("user", username)
+        user_cache.put(username, user)  # Replaces the cached None from `username_available`
+        return {"username": username}
     else:
         return f"This username ({username}) already exists.\nPlease choose a unique name."
 
 
-@anvil.server.callable
-def get_pass_hash(username):
-    return app_tables.users.get(username=username)["password_hash"]
+@register
+def search_players(prefix, limit=SEARCH_PAGE_SIZE, after=None):
+    """Usernames starting with `prefix` (ignoring case), for autocomplete. Served from `player_index`, not the table.
 
+    Pass the last username of a page as `after` to get the next page.
+    Returns the `players` on the page, and whether there are `more`.
+    """
+    players, more = player_index.search(prefix, max(1, min(limit, SEARCH_PAGE_SIZE)), after)
+    return {"players": players, "more": more}
+
+
+def disable_account(username):
+    """Not a callable. Run this from a shell on the server."""
+    app_tables.users.get(username=username)["enabled"] = False
+    changes.publish("user", username)
+
+
+@register
+def get_user_cache_stats():
+    return user_cache.stats()
+
+
+@register
+def get_result_cache_stats():
+    return result_cache.stats()
+
+
+@register(pooled=False)
+def get_shard_count():
+    return SHARD_COUNT
+
+
+@register(pooled=False, sharded=True)
+def batch(calls):
+    """Make several calls in one round trip, one after the other.
+
+    Each call is a (callable name, args) or (callable name, args, kwargs).
+    Returns a {"result": ...} or {"error": message} for each, in order. One call failing doesn't stop the rest.
+    Not pooled itself, since each call goes through the pool on its own.
+    """
+    results = []
+    for name, args, *kwargs in calls:
+        f = callables.get(name)
+        if f is None or f is callables["batch"]:
+            results.append({"error": f"There is no callable named {name}."})
+            continue
+        try:
+            results.append({"result": f(*args, **(kwargs[0] if kwargs else {}))})
+        except Exception as err:
+            results.append({"error": f"{name} failed: {err}"})
+    return results
+
+
+@register(pooled=False)
+def get_metrics():
+    """Call counts, timings, table operations and payload sizes for every callable since the server started.
+
+    Along with the state of the worker pool, how many calls were coalesced, and the matchmaking queue.
+    Not pooled itself, so it still answers when the server is saturated.
+    """
+    return {
+        **metrics.snapshot(),
+        "pool": pool.stats(),
+        "coalesced": flights.stats(),
+        "matchmaking": matchmaker.stats(),
+    }
 
-@anvil.server.callable
-def create_game(username, opponent_name):
-    user = app_tables.users.get(username=username)
-    opponent = app_tables.users.get(username=opponent_name)
-    if opponent is None:
-        return "This player does not exist in our database. Please try again."
-    existing_game = app_tables.games.get(player1=user, player2=opponent, status=q.not_(Status.COMPLETE.value))
-    if existing_game is not None:
-        return f"An active game between you and {opponent_name} already exists."
 
-    return app_tables.games.add_row(
+def start_session(user):
+    token = secrets.token_urlsafe(32)
+    app_tables.sessions.add_row(user=user, token=token, expires=datetime.now(timezone.utc) + SESSION_LIFETIME)
+    return token
+
+
+@register
+def login(username, password):
+    """Check the password here rather than on the client, and hand back everything the home screen needs.
+
+    Returns a dict with a session `token` and the `game_summaries` for the user, or an error message.
+    """
+    user = get_user(username)
+    if user is None or not user["enabled"]:
+        return f"Oh no! There isn't an account for {username}."
+    password_hash = bytes(user["password_hash"], encoding="utf-8")
+    correct_pass = password_checker.submit(bcrypt.checkpw, bytes(password, encoding="utf8"), password_hash).result()
+    if not correct_pass:
+        return f"Oh no! That password isn't correct for {username}."
+    return {"token": start_session(user), "game_summaries": home_snapshot(username)}
+
+
+def session_username(token):
+    """Whose session `token` is, or None if the session is unknown or expired (or their account is disabled)."""
+    session = app_tables.sessions.get(token=token)
+    if session is None or session["expires"] < datetime.now(timezone.utc):
+        return None
+    username = session["user"]["username"]
+    if not get_user(username)["enabled"]:
+        return None
+    return username
+
+
+@register
+def resume_session(token):
+    """Lets a returning player skip logging in. Returns None if the session is unknown or expired.
+
+    Otherwise, returns the `username` and their `game_summaries`.
+    """
+    username = session_username(token)
+    if username is None:
+        return None
+    return {"username": username, "game_summaries": home_snapshot(username)}
+
+
+def active_games_for(user):
+    """Direct lookup through the active_games membership table, rather than searching games.
+
+    Cached until one of the user's games changes.
+    """
+    return result_cache.get_or_load(
+        ("active_games", user["username"]),
+        lambda _: [membership["game"] for membership in app_tables.active_games.search(user=user)],
+    )
+
+
+def active_game_between(user, key):
+    """The user's active game with whoever else is in the pair `key`, or None.
+
+    Games from before pairs were kept to one active game can leave a pair with two (see
+    tests/tools/backfill_active_games.py), so this takes the first one rather than using `get`, which would raise.
+    """
+    for membership in app_tables.active_games.search(user=user, pair_key=key):
+        return membership["game"]
+    return None
+
+
+@in_transaction
+def start_game(user, opponent):
+    """Returns the new game, or None if there is already an active game between these two players."""
+    return add_game(user, opponent)
+
+
+def add_game(user, opponent):
+    """Has to be called inside a transaction."""
+    key = pair_key(user["username"], opponent["username"])
+    if active_game_between(user, key) is not None:
+        return None
+
+    game = app_tables.games.add_row(
         player1=user,
         player2=opponent,
-        player1_board=BlobMedia("text/plain", compress(pickle.dumps(None))),
-        player2_board=BlobMedia("text/plain", compress(pickle.dumps(None))),
+        **Board().to_cols("player1_board"),
+        **Board().to_cols("player2_board"),
         status=Status.SETUP.value,
         setup_status=SetupStatus.NEITHER.value,
         turn=choice((user, opponent)),
+        version=0,
+        pair_key=key,
+        keyframe_version=0,
     )
+    for player in (user, opponent):
+        app_tables.active_games.add_row(user=player, game=game, pair_key=key)
+    return game
 
 
-@anvil.server.callable
-def get_incomplete_games(username):
-    user = app_tables.users.get(username=username)
-    games = list(app_tables.games.search(q.any_of(player1=user, player2=user), status=q.not_(Status.COMPLETE.value)))
+def retire_game(game):
+    """Drop a completed game from both players' active games."""
+    for membership in app_tables.active_games.search(game=game):
+        membership.delete()
+
+
+@register(sharded=True)
+def create_game(username, opponent_name):
+    user = get_user(username)
+    opponent = get_user(opponent_name)
+    if opponent is None:
+        return "This player does not exist in our database. Please try again."
+
+    game = start_game(user, opponent)
+    if game is None:
+        return f"An active game between you and {opponent_name} already exists."
+    changes.publish("notify", username, opponent_name)
+    return summarize_game(game, username)
+
+
+@in_transaction
+def start_games(pairs):
+    """Start a game for each pair of usernames, all in one transaction.
+
+    If a pair already has a game going, that's the game they get.
+    """
+    games = []
+    for username, opponent_name in pairs:
+        user, opponent = get_user(username), get_user(opponent_name)
+        game = add_game(user, opponent)
+        if game is None:
+            game = active_game_between(user, pair_key(username, opponent_name))
+        games.append(game)
     return games
+
+
+def create_matched_games(pairs):
+    """For the matchmaker. Returns the summary of each new game, from each player's point of view."""
+    results = []
+    for (username, opponent_name), game in zip(pairs, start_games(pairs)):
+        changes.publish("notify", username, opponent_name)
+        results.append({username: summarize_game(game, username), opponent_name: summarize_game(game, opponent_name)})
+    return results
+
+
+matchmaker = Matchmaker(create_matched_games)
+if SHARD == MATCHMAKING_SHARD:
+    matchmaker.start()
+
+
+@register(pooled=False, sharded=True)
+def find_opponent(username, timeout=LONG_POLL_TIMEOUT):
+    """Join the matchmaking queue, and wait for whoever joins next. Call again to keep waiting.
+
+    Returns the summary of the new game, None if there's no opponent yet, or an error message.
+    """
+    if get_user(username) is None:
+        return f"Oh no! There isn't an account for {username}."
+    return matchmaker.find(username, min(timeout, LONG_POLL_TIMEOUT))
+
+
+@register(pooled=False, sharded=True)
+def cancel_find_opponent(username):
+    matchmaker.cancel(username)
+
+
+@register(coalesced=True)
+def get_incomplete_games(username):
+    user = get_user(username)
+    return [game_record(game) for game in active_games_for(user)]
+
+
+def summarize_game(game, username):
+    """Flatten a games row into everything the home screen needs to know, from `username`'s point of view."""
+    player1, player2 = game["player1"]["username"], game["player2"]["username"]
+    return {
+        "game_id": game.get_id(),
+        "player1": player1,
+        "player2": player2,
+        "opponent": player2 if player1 == username else player1,
+        **game_state(game),
+    }
+
+
+def game_state(game):
+    """Everything about a game that changes, apart from the boards."""
+    turn, winner = game["turn"], game["winner"]
+    return {
+        "status": game["status"],
+        "setup_status": game["setup_status"],
+        "turn": None if turn is None else turn["username"],
+        "winner": None if winner is None else winner["username"],
+        "version": game["version"] or 0,
+    }
+
+
+@register
+def get_home_snapshot(username, known_game_ids=()):
+    """Summaries of all the active games for a user, in a single round trip.
+
+    Games in `known_game_ids` are included even if they've been completed,
+    so that a client can find out who won a game it was already displaying.
+    """
+    return home_snapshot(username, known_game_ids)
+
+
+@flights.coalesce
+def home_snapshot(username, known_game_ids=()):
+    """Every client on the home screen asks for this regularly, and again at login.
+
+    Cached until one of the user's games changes. A client keeps sending the same `known_game_ids`
+    until it sees a change, so they're part of the key.
+    """
+    return result_cache.get_or_load(
+        ("home_snapshot", username, tuple(known_game_ids)), lambda _: load_home_snapshot(username, known_game_ids)
+    )
+
+
+def load_home_snapshot(username, known_game_ids):
+    user = get_user(username)
+    summaries = {game.get_id(): summarize_game(game, username) for game in active_games_for(user)}
+    for game_id in known_game_ids:
+        if game_id not in summaries:
+            game = app_tables.games.get_by_id(game_id)
+            if game is not None:
+                summaries[game_id] = summarize_game(game, username)
+                continue
+            archived = app_tables.archived_games.get(game_id=game_id)
+            if archived is not None:
+                summaries[game_id] = summarize_archived_game(archived, username)
+    return list(summaries.values())
+
+
+def game_record(game):
+    """Everything a client needs to load a game, as plain data rather than a row, so that any transport can send it.
+
+    Players are usernames, like in `summarize_game`. Each board is in the columns from `Board.to_cols`
+    (even for rows that still keep it in the old media column), as of the last keyframe,
+    and `moves` are the moves made since then.
+    """
+    record = {
+        "game_id": game.get_id(),
+        "player1": game["player1"]["username"],
+        "player2": game["player2"]["username"],
+        **game_state(game),
+        "moves": moves_since_keyframe(app_tables, q, game),
+    }
+    for board_col in BOARD_COLS:
+        if game[f"{board_col}_animals"] is None:
+            record.update(Board.from_row(game, board_col).to_cols(board_col))
+        else:
+            record.update({col: game[col] for col in (f"{board_col}_{part}" for part in ("animals", "misses"))})
+    return record
+
+
+@register(sharded=True)
+def get_game(game_id):
+    game = app_tables.games.get_by_id(game_id)
+    if game is None:
+        return "This game has finished, and isn't kept anymore."
+    return game_record(game)
+
+
+def bump_version(game, **cols):
+    """Write to a games row. Every write has to go through here so that clients can tell something changed.
+
+    The hash and count that go with a board are worked out again here, so they always match the board.
+    """
+    for board_col in BOARD_COLS:
+        if f"{board_col}_animals" in cols:
+            cols.update(Board.from_row(cols, board_col).to_cols(board_col))
+    game.update(version=(game["version"] or 0) + 1, **cols)
+    if cols.get("status") == Status.COMPLETE.value:
+        retire_game(game)
+        archive_game(app_tables, game)
+
+
+def player_write_error(game, username, cols):
+    """Why `username` may not write `cols` to `game`, or None if they may.
+
+    Players only commit their own board (during setup), that they've finished setup, and the game starting.
+    Everything else, turns included, is written by the server itself.
+    """
+    board_cols = {game["player1"]["username"]: "player1_board", game["player2"]["username"]: "player2_board"}
+    if username not in board_cols:
+        return "This isn't one of your games."
+    board_col = board_cols[username]
+    done = SetupStatusInternal.PLAYER1_DONE if board_col == "player1_board" else SetupStatusInternal.PLAYER2_DONE
+    allowed = {f"{board_col}_{part}" for part in ("animals", "misses", "hash", "left")} | {"setup_status", "status"}
+    if not set(cols) <= allowed:
+        return f"You can't change {', '.join(sorted(set(cols) - allowed))} in a game."
+    if any(col.startswith(board_col) for col in cols) and game["status"] != Status.SETUP.value:
+        return "Your board can't change once the game has started."
+    if cols.get("setup_status", done.value) not in (done.value, SetupStatus.COMPLETE.value):
+        return f"You can't change the setup status to {cols['setup_status']}."
+    if cols.get("status", Status.ACTIVE.value) != Status.ACTIVE.value:
+        return f"You can't change the status of a game to {cols['status']}."
+    return None
+
+
+@in_transaction
+def write_game(game_id, username, expected_version=None, **cols):
+    """Write `cols` to a game for one of its players. Returns the game, and None if the write happened.
+
+    Otherwise, returns why not: an error message, or the current `game_state`
+    if `expected_version` is given and the game has moved on from it.
+    Note: this commits before returning, so call `notify_players` afterwards.
+    Otherwise a woken client could read the game before the write lands.
+    """
+    game = app_tables.games.get_by_id(game_id)
+    if game is None:
+        return game, "This game has finished, and isn't kept anymore."
+    err = player_write_error(game, username, cols)
+    if err is not None:
+        return game, err
+    if expected_version is not None and (game["version"] or 0) != expected_version:
+        return game, game_state(game)
+    bump_version(game, **cols)
+    return game, None
+
+
+def notify_players(game):
+    changes.publish("game", game.get_id())
+    changes.publish("notify", game["player1"]["username"], game["player2"]["username"])
+
+
+@register(sharded=True)
+def update_game(token, game_id, expected_version=None, **cols):
+    """Write one or more columns of a game in a single request, as the player whose session `token` is.
+
+    Returns the new version, or an error message if they aren't allowed to (see `player_write_error`).
+    With an `expected_version`, the write only happens if nobody else has written to the game since.
+    If somebody has, the current `game_state` comes back instead, so the client can decide what to do
+    without fetching the game again.
+    """
+    username = session_username(token)
+    if username is None:
+        return "Your session has expired. Please log in again."
+    game, not_written = write_game(game_id, username, expected_version, **cols)
+    if not_written is not None:
+        return not_written
+    notify_players(game)
+    return game["version"]
+
+
+@register(sharded=True)
+def get_moves(game_id, since_version):
+    """The `moves` made after `since_version`, as [shooter, row, col, hit, version] lists, oldest first.
+
+    Clients apply these to the boards they already have, rather than fetching the whole game again after every turn.
+    The `board_hashes` of the boards as they are now (by column) let them check that they got the same result.
+    """
+    game = app_tables.games.get_by_id(game_id)
+    if game is None:  # It's finished, and been purged since
+        archived = app_tables.archived_games.get(game_id=game_id)
+        moves = [move for move in archived["moves"] if move[4] > since_version]
+        return {"moves": moves, "board_hashes": {}}
+    board_hashes = {board_col: game[f"{board_col}_hash"] for board_col in BOARD_COLS}
+    return {"moves": moves_after(app_tables, q, game, since_version), "board_hashes": board_hashes}
+
+
+@register(sharded=True, coalesced=True)
+def get_game_version(game_id):
+    """A cheap probe of a game that doesn't touch either board.
+
+    Returns (version, turn_username, winner_username). Cached until the game changes.
+    """
+    return result_cache.get_or_load(("game_version", game_id), lambda _: load_game_version(game_id))
+
+
+def load_game_version(game_id):
+    game = app_tables.games.get_by_id(game_id)
+    if game is None:  # It's finished, and been purged since
+        game = app_tables.archived_games.get(game_id=game_id)
+        winner = game["winner"]
+        return game["version"] or 0, None, None if winner is None else winner["username"]
+    turn, winner = game["turn"], game["winner"]
+    return (
+        game["version"] or 0,
+        None if turn is None else turn["username"],
+        None if winner is None else winner["username"],
+    )
+
+
+@register(pooled=False)
+def wait_for_change(username, seen_seq=None, timeout=LONG_POLL_TIMEOUT):
+    """Hold the request open until one of the user's games changes, or the timeout passes.
+
+    Returns a change count to pass back in on the next call.
+    """
+    return notifier.wait(username, seen_seq, min(timeout, LONG_POLL_TIMEOUT))
+
+
+@register
+def get_history(username, page=0, page_size=HISTORY_PAGE_SIZE):
+    """Finished games for a user, most recent first, a page at a time.
+
+    Returns the `games` on the page, and whether there are `more` pages after it.
+    Each game is summarized like in `get_home_snapshot`, plus when it `finished`, the compacted boards
+    (see `sonora.server_dir.archive`), and the move log as [shooter, row, col, hit, version].
+    Games from before the move log have an empty one, and the final boards in their columns instead.
+    """
+    user = get_user(username)
+    page_size = max(1, min(page_size, HISTORY_PAGE_SIZE))
+    start = page * page_size
+    archived_games = app_tables.archived_games.search(
+        order_by("finished", ascending=False), q.any_of(player1=user, player2=user)
+    )[start : start + page_size + 1]
+    games = [
+        {
+            **summarize_archived_game(archived, username),
+            "finished": archived["finished"],
+            "player1_board": archived["player1_board"],
+            "player2_board": archived["player2_board"],
+            "moves": archived["moves"],
+            **{
+                col: archived[col]
+                for board_col in BOARD_COLS
+                for col in (f"{board_col}_animals", f"{board_col}_misses")
+                if archived[col] is not None
+            },
+        }
+        for archived in archived_games[:page_size]
+    ]
+    return {"games": games, "more": len(archived_games) > page_size}
+
+
+def current_board(game, board_col, pending_moves):
+    """The keyframe in `board_col`, with the moves made against it since then (out of `pending_moves`) applied."""
+    board = Board.from_row(game, board_col)
+    owner = game["player1" if board_col == "player1_board" else "player2"]["username"]
+    for shooter, row, col, hit, _ in pending_moves:
+        if shooter != owner:
+            board.apply_shot(row, col, hit)
+    return board
+
+
+@in_transaction
+def resolve_turn(game_id, username, row, col):
+    """Everything about a turn happens inside of one transaction, so the game can't be left half updated."""
+    game = app_tables.games.get_by_id(game_id)
+    if game is None:
+        return game, "This game has finished, and isn't kept anymore."
+    if game["status"] != Status.ACTIVE.value or game["turn"] is None:
+        return game, f"This game is not active. (Status: {game['status']})"
+    if game["turn"]["username"] != username:
+        return game, "It isn't your turn."
+
+    shooter_is_p1 = game["turn"] == game["player1"]
+    target_col = "player2_board" if shooter_is_p1 else "player1_board"
+    pending_moves = moves_since_keyframe(app_tables, q, game)
+    board = current_board(game, target_col, pending_moves)
+    existing = board.grid[(row, col)].obj
+    if isinstance(existing, Miss) or isinstance(existing, Segment) and existing.shot:
+        return game, "A photo has already been taken here."
+    board + Photo(row, col)
+    board.photo_to_shot_or_miss()
+
+    outcome = {
+        "hit": isinstance(board.grid[(row, col)].obj, Segment),
+        "animal_shot": None if board.full_animal_just_shot is None else type(board.full_animal_just_shot).__name__,
+        "won": board.all_animals_shot(),
+    }
+    version = (game["version"] or 0) + 1
+    add_move(app_tables, game, username, row, col, outcome["hit"], version)
+    cols = {
+        f"{target_col}_hash": zobrist.to_text(board.hash),
+        f"{target_col}_left": board.segments_left(),
+    }
+    # Games from before keyframes get their first one now.
+    keyframe_due = game["keyframe_version"] is None or len(pending_moves) + 1 >= KEYFRAME_INTERVAL
+    if keyframe_due or outcome["won"]:  # Won games get archived from their boards
+        other_col = "player1_board" if shooter_is_p1 else "player2_board"
+        other_board = current_board(game, other_col, pending_moves)
+        for board_col, keyframe in ((target_col, board), (other_col, other_board)):
+            cols.update(keyframe.to_cols(board_col))
+        cols["keyframe_version"] = version
+    if outcome["won"]:
+        cols.update(status=Status.COMPLETE.value, winner=game["turn"], turn=None)
+    else:
+        cols.update(turn=game["player2"] if shooter_is_p1 else game["player1"])
+    bump_version(game, **cols)
+    outcome["version"] = game["version"]
+    return game, outcome
+
+
+@register(sharded=True)
+def take_turn(token, game_id, row, col):
+    """Take a photo at (row, col), as the player whose session `token` is. It has to be their turn.
+
+    Returns the outcome of the turn (or an error message).
+    """
+    if row not in range(1, ROWS + 1) or col not in tuple(COLS):
+        return f"({row}, {col}) isn't a square on the board."
+    username = session_username(token)
+    if username is None:
+        return "Your session has expired. Please log in again."
+    game, outcome_or_err = resolve_turn(game_id, username, row, col)
+    if not isinstance(outcome_or_err, str):
+        notify_players(game)
+    return outcome_or_err
@@ -0,0 +1,106 @@
+"""Finished games move out of the games table and into archived_games, so the games table only grows with active play.
+
+A game is archived as soon as it's won, in the same transaction as the winning turn.
+The archive keeps a compact copy: where each animal was, plus the log of every move
+(which is enough to rebuild both boards exactly), rather than the pickled boards.
+Games from before the move log existed have nothing to rebuild their shots and misses from,
+so their final boards are kept too, in the same columns as in the games table (see `Board.to_cols`).
+The games row itself is kept for a while afterwards, for clients that are still looking at it,
+and then purged by `purge_archived_games`.
+
+These take `app_tables` and `q` as arguments, so that tools can run them against the tables directly.
+"""
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from loguru import logger
+
+from sonora.board_objects import Animal
+from sonora.models import Board
+from sonora.server_dir.move_log import all_moves, delete_moves
+from sonora.static import SetupStatus, Status
+
+
+def compact_board(board):
+    """[[animal class name, base row, base col], ...]. Misses and shots can be rebuilt from the move log."""
+    return [[type(obj).__name__, obj.base_row, obj.base_col] for obj in board.contents if isinstance(obj, Animal)]
+
+
+def final_board_cols(game, moves):
+    """The animals and misses columns of both boards, for a game whose moves can't rebuild them. Otherwise nothing."""
+    if moves:
+        return {}
+    cols = {}
+    for board_col in ("player1_board", "player2_board"):
+        board_cols = Board.from_row(game, board_col).to_cols(board_col)
+        cols.update({col: board_cols[col] for col in (f"{board_col}_animals", f"{board_col}_misses")})
+    return cols
+
+
+def archive_game(app_tables, game):
+    """Copy a completed game into the archive. Doesn't touch the games row."""
+    if app_tables.archived_games.get(game_id=game.get_id()) is not None:
+        return
+    moves = all_moves(app_tables, game)
+    app_tables.archived_games.add_row(
+        game_id=game.get_id(),
+        player1=game["player1"],
+        player2=game["player2"],
+        winner=game["winner"],
+        pair_key=game["pair_key"],
+        version=game["version"] or 0,
+        finished=datetime.now(timezone.utc),
+        player1_board=compact_board(Board.from_row(game, "player1_board")),
+        player2_board=compact_board(Board.from_row(game, "player2_board")),
+        moves=moves,
+        purged=False,
+        **final_board_cols(game, moves),
+    )
+
+
+def purge_archived_games(app_tables, q, older_than):
+    """Delete the games rows of games that were archived before `older_than`. Returns how many were deleted."""
+    purged = 0
+    for archived in app_tables.archived_games.search(purged=False, finished=q.less_than(older_than)):
+        game = app_tables.games.get_by_id(archived["game_id"])
+        if game is not None:
+            delete_moves(app_tables, game)
+            game.delete()
+            purged += 1
+        archived["purged"] = True
+    return purged
+
+
+def start_purging(app_tables, q, interval, grace):
+    """Every `interval` seconds, purge games that were archived more than `grace` seconds ago. From a background thread."""
+
+    def purge_forever():
+        while True:
+            time.sleep(interval)
+            try:
+                purged = purge_archived_games(app_tables, q, datetime.now(timezone.utc) - timedelta(seconds=grace))
+            except Exception as err:  # Keep going through dropped connections and the like
+                logger.warning(f"Couldn't purge archived games ({err}).")
+                continue
+            if purged:
+                logger.info(f"Purged {purged} archived games.")
+
+    threading.Thread(target=purge_forever, daemon=True).start()
+
+
+def summarize_archived_game(archived, username):
+    """The same shape as `summarize_game` in the server, so clients can't tell an archived game apart."""
+    player1, player2 = archived["player1"]["username"], archived["player2"]["username"]
+    winner = archived["winner"]
+    return {
+        "game_id": archived["game_id"],
+        "player1": player1,
+        "player2": player2,
+        "opponent": player2 if player1 == username else player1,
+        "status": Status.COMPLETE.value,
+        "setup_status": SetupStatus.COMPLETE.value,
+        "turn": None,
+        "winner": None if winner is None else winner["username"],
+        "version": archived["version"] or 0,
+    }
@@ -0,0 +1,31 @@
+"""Picks where the server keeps its data, based on the SONORA_BACKEND environment variable.
+
+* "anvil" (the default): the app's Anvil data tables, over the uplink.
+* "sqlite": a local SQLite file at SONORA_DB (default "sonora.db"). No Anvil account needed.
+
+Either way, this module provides `app_tables`, `q`, `order_by`, `BlobMedia` and `in_transaction`,
+so the server code doesn't need to know which one it's talking to.
+Table operations are counted towards the metrics of whichever callable makes them.
+"""
+import os
+
+from sonora.server_dir.metrics import CountingAppTables, metrics
+
+BACKEND = os.environ.get("SONORA_BACKEND", "anvil")
+
+if BACKEND == "anvil":
+    import anvil.tables.query as q
+    from anvil import BlobMedia
+    from anvil.tables import app_tables, in_transaction, order_by
+elif BACKEND == "sqlite":
+    from sonora.server_dir import sqlite_query as q
+    from sonora.server_dir.sqlite_query import order_by
+    from sonora.server_dir.sqlite_tables import BlobMedia, Database
+
+    db = Database(os.environ.get("SONORA_DB", "sonora.db"))
+    app_tables = db.app_tables
+    in_transaction = db.in_transaction
+else:
+    raise ValueError(f'SONORA_BACKEND must be "anvil" or "sqlite", not "{BACKEND}".')
+
+app_tables = CountingAppTables(app_tables, metrics)
@@ -0,0 +1,69 @@
+"""In-process caches for the uplink server."""
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """A size bounded, thread safe cache that throws out whatever was used least recently.
+
+    Hits and misses are counted so we can tell whether the cache is earning its keep.
+    If `ttl` (in seconds) is given, entries are also thrown out once they are that old,
+    as a safety net for caches that are meant to be invalidated whenever their answer changes.
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (value, expiry time)
+        self._invalidations = 0
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, load):
+        """Return the cached value for `key`, calling `load(key)` to fill it in if needed.
+
+        If anything is invalidated while `load` runs, its result isn't kept, since it may be from before the change.
+        """
+        with self._lock:
+            value, expires = self._data.get(key, (_MISSING, None))
+            if value is not _MISSING and (expires is None or expires > time.monotonic()):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+            invalidations = self._invalidations
+        value = load(key)  # Don't hold the lock during a table query
+        with self._lock:
+            if invalidations == self._invalidations:
+                self._put(key, value)
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._put(key, value)
+
+    def _put(self, key, value):
+        self._data[key] = (value, None if self.ttl is None else time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._invalidations += 1
+            self._data.pop(key, None)
+
+    def invalidate_matching(self, predicate):
+        """Invalidate every key for which `predicate(key)` is true."""
+        with self._lock:
+            self._invalidations += 1
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize}
@@ -0,0 +1,122 @@
+"""Pairs up players who want a game with anyone, first come first served.
+
+The queue lives in memory, so joining it, and being paired, never touches the tables.
+Pairs are handed to a background thread that creates all of their games together, every `interval` seconds.
+Players wait for their game with a long poll, just like `wait_for_change`.
+Players who stop polling (say, because they closed the app) are dropped from the queue,
+and so are games that nobody has come to pick up, after `stale_after` seconds.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from loguru import logger
+
+from sonora.static import LONG_POLL_TIMEOUT
+
+MATCH_FAILED = "Couldn't start a game with your opponent. Please try again."
+
+
+class Matchmaker:
+    def __init__(self, create_games, interval=0.25, stale_after=LONG_POLL_TIMEOUT):
+        """`create_games(pairs)` starts a game for each (username, username) pair, all at once.
+
+        It returns, for each pair, a dict of what to give each player (a game summary or an error message).
+        """
+        self.create_games = create_games
+        self.interval = interval
+        self.stale_after = stale_after
+        self._cond = threading.Condition()
+        self._waiting = OrderedDict()  # Used as an ordered set, so joining, pairing and leaving are all O(1)
+        self._pairs = []  # Paired, but their games haven't been created yet
+        self._paired = set()
+        self._matches = {}  # Results that haven't been picked up yet
+        self._polls = {}  # How many `find` calls each player has in progress
+        self._last_polled = {}  # When each player in the queue (or with a match) last finished a `find` call
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def find(self, username, timeout):
+        """Join the queue (unless already in it), then wait up to `timeout` seconds for a game.
+
+        Returns the player's result from `create_games`, or None if they are still waiting.
+        """
+        with self._cond:
+            self._polls[username] = self._polls.get(username, 0) + 1
+            try:
+                if not self._queued(username):
+                    opponent = self._next_waiter()
+                    if opponent is not None:
+                        self._pairs.append((opponent, username))
+                        self._paired.update((opponent, username))
+                        self._cond.notify_all()
+                    else:
+                        self._waiting[username] = None
+                self._cond.wait_for(lambda: username in self._matches, timeout)
+                return self._matches.pop(username, None)
+            finally:
+                self._polls[username] -= 1
+                if not self._polls[username]:
+                    del self._polls[username]
+                if self._queued(username):
+                    self._last_polled[username] = time.monotonic()
+                else:
+                    self._last_polled.pop(username, None)
+
+    def cancel(self, username):
+        """Leave the queue. Too late if already paired, since the game is on its way."""
+        with self._cond:
+            self._waiting.pop(username, None)
+            if not self._queued(username):
+                self._last_polled.pop(username, None)
+
+    def _queued(self, username):
+        return username in self._waiting or username in self._paired or username in self._matches
+
+    def _stale(self, username, now):
+        """Whether a player has stopped polling. Nobody is, while they have a `find` call in progress."""
+        return username not in self._polls and now - self._last_polled.get(username, now) > self.stale_after
+
+    def _next_waiter(self):
+        """Take the player who has been waiting longest off the queue, dropping any who have stopped polling."""
+        now = time.monotonic()
+        while self._waiting:
+            opponent, _ = self._waiting.popitem(last=False)
+            if not self._stale(opponent, now):
+                return opponent
+            logger.info(f"Dropped {opponent} from the matchmaking queue, since they stopped polling.")
+            self._last_polled.pop(opponent, None)
+        return None
+
+    def _drop_unclaimed(self):
+        """Forget matches whose player has stopped polling. Their game was still created, so it's on their home screen."""
+        now = time.monotonic()
+        for username in [username for username in self._matches if self._stale(username, now)]:
+            del self._matches[username]
+            self._last_polled.pop(username, None)
+
+    def stats(self):
+        with self._cond:
+            return {"waiting": len(self._waiting), "pairing": len(self._pairs), "unclaimed": len(self._matches)}
+
+    def run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pairs, self.stale_after)
+                self._drop_unclaimed()
+                if not self._pairs:
+                    continue
+            time.sleep(self.interval)  # Let a few more pairs gather, so they can share the trip to the tables
+            with self._cond:
+                pairs, self._pairs = self._pairs, []
+            try:
+                results = self.create_games(pairs)
+            except Exception as err:
+                logger.warning(f"Couldn't create games for {len(pairs)} matched pairs ({err}).")
+                results = [{username: MATCH_FAILED for username in pair} for pair in pairs]
+            with self._cond:
+                for pair, result in zip(pairs, results):
+                    self._paired.difference_update(pair)
+                    self._matches.update(result)
+                self._cond.notify_all()
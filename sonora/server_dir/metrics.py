@@ -0,0 +1,186 @@
+"""Counts and timings for every server callable, so we know where the server spends its time."""
+import functools
+import json
+import math
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from loguru import logger
+
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, math.inf)
+
+
+class Histogram:
+    """Counts of values (in ms) falling into each of `BUCKETS_MS`. A bucket holds everything up to its bound."""
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS_MS)
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        self.counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def to_dict(self):
+        return {"counts": list(self.counts), "total_ms": self.total, "max_ms": self.max}
+
+
+class CallableStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.wall = Histogram()
+        self.cpu = Histogram()
+        self.table_ops = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "wall": self.wall.to_dict(),
+            "cpu": self.cpu.to_dict(),
+            "table_ops": self.table_ops,
+            "request_bytes": self.request_bytes,
+            "response_bytes": self.response_bytes,
+        }
+
+
+class _CallRecord:
+    """What happened during a single call. Only touched by the thread making the call."""
+
+    def __init__(self):
+        self.table_ops = 0
+
+
+def payload_size(obj):
+    """A rough estimate of how many bytes `obj` takes on the wire.
+
+    A row is sent with its simple columns. Its media and linked rows only count as references,
+    since they aren't sent until they're asked for.
+    """
+    if obj is None or isinstance(obj, (bool, int, float)):
+        return 8
+    if isinstance(obj, str):
+        return len(obj.encode("utf-8"))
+    if isinstance(obj, (bytes, bytearray)):
+        return len(obj)
+    if hasattr(obj, "get_bytes"):
+        return len(obj.get_bytes())
+    if hasattr(obj, "get_id"):
+        items = []
+        for col, value in obj:
+            items += [col, None if hasattr(value, "get_id") or hasattr(value, "get_bytes") else value]
+    elif isinstance(obj, dict):
+        items = [*obj.keys(), *obj.values()]
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        items = obj
+    else:
+        return 8
+    return sum(payload_size(item) for item in items)
+
+
+class Metrics:
+    def __init__(self):
+        self._stats = defaultdict(CallableStats)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def wrap(self, name, f):
+        """Record everything about each call to `f` under `name`."""
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            record = _CallRecord()
+            outer_record = getattr(self._local, "record", None)  # Callables can call other callables
+            self._local.record = record
+            wall_start, cpu_start = time.perf_counter(), time.thread_time()
+            result, failed = None, True
+            try:
+                result = f(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                wall_ms = (time.perf_counter() - wall_start) * 1000
+                cpu_ms = (time.thread_time() - cpu_start) * 1000
+                self._local.record = outer_record
+                request_bytes = payload_size((args, kwargs))
+                response_bytes = payload_size(result)
+                with self._lock:
+                    stats = self._stats[name]
+                    stats.calls += 1
+                    stats.errors += failed
+                    stats.wall.add(wall_ms)
+                    stats.cpu.add(cpu_ms)
+                    stats.table_ops += record.table_ops
+                    stats.request_bytes += request_bytes
+                    stats.response_bytes += response_bytes
+
+        return wrapper
+
+    def count_table_op(self):
+        record = getattr(self._local, "record", None)
+        if record is not None:
+            record.table_ops += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "buckets_ms": [str(bound) for bound in BUCKETS_MS],
+                "callables": {name: stats.to_dict() for name, stats in self._stats.items()},
+            }
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump({"time": time.time(), **self.snapshot()}, f, indent=2)
+
+    def start_dumping(self, path, interval):
+        """Write a snapshot to `path` every `interval` seconds, from a background thread."""
+
+        def dump_forever():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.dump(path)
+                except OSError as err:
+                    logger.warning(f"Couldn't dump metrics to {path}: {err}")
+
+        threading.Thread(target=dump_forever, daemon=True).start()
+
+
+class CountingTable:
+    """Passes everything through to the real table, counting the operations that hit the backend."""
+
+    OPS = {"get", "get_by_id", "search", "add_row"}
+
+    def __init__(self, table, metrics):
+        self._table = table
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        attr = getattr(self._table, name)
+        if name not in self.OPS:
+            return attr
+
+        def counted(*args, **kwargs):
+            self._metrics.count_table_op()
+            return attr(*args, **kwargs)
+
+        return counted
+
+
+class CountingAppTables:
+    def __init__(self, app_tables, metrics):
+        self._app_tables = app_tables
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        return CountingTable(getattr(self._app_tables, name), self._metrics)
+
+
+metrics = Metrics()
@@ -0,0 +1,43 @@
+"""The log of every move in every game, kept in the moves table, one row per move.
+
+A turn adds a row here, so it never rewrites anything that grows as the game goes on.
+Moves are [shooter, row, col, hit, version] lists everywhere outside of this module,
+where `version` is the version of the game that the move took it to.
+
+These take `app_tables` and `q` as arguments, like `sonora.server_dir.archive`,
+so that tools can run them against the tables directly.
+"""
+
+
+def add_move(app_tables, game, shooter, row, col, hit, version):
+    app_tables.moves.add_row(game=game, shooter=shooter, row=row, col=col, hit=hit, version=version)
+
+
+def moves_after(app_tables, q, game, version):
+    """The moves of `game` that took it past `version`, oldest first."""
+    return _log(app_tables.moves.search(game=game, version=q.greater_than(version)))
+
+
+def all_moves(app_tables, game):
+    """Every move of `game`, oldest first."""
+    return _log(app_tables.moves.search(game=game))
+
+
+def _log(rows):
+    moves = [[move["shooter"], move["row"], move["col"], move["hit"], move["version"]] for move in rows]
+    return sorted(moves, key=lambda move: move[4])
+
+
+def moves_since_keyframe(app_tables, q, game):
+    """The moves made since the boards in a games row were last written, which have to be applied to them.
+
+    Rows from before keyframes existed have no `keyframe_version`, and their boards are always current.
+    """
+    if game["keyframe_version"] is None:
+        return []
+    return moves_after(app_tables, q, game, game["keyframe_version"])
+
+
+def delete_moves(app_tables, game):
+    for move in app_tables.moves.search(game=game):
+        move.delete()
@@ -0,0 +1,33 @@
+"""Lets callables sleep until something they care about changes, instead of clients polling on an interval."""
+import threading
+from collections import defaultdict
+
+
+class ChangeNotifier:
+    """Keeps a count of changes per username, and wakes up anyone waiting on that username.
+
+    Each username gets its own Condition (all sharing one lock),
+    so a write only wakes up the two players in that game rather than every waiting client.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conditions = defaultdict(lambda: threading.Condition(self._lock))
+        self._seqs = defaultdict(int)
+
+    def notify(self, *usernames):
+        with self._lock:
+            for username in usernames:
+                self._seqs[username] += 1
+                self._conditions[username].notify_all()
+
+    def wait(self, username, seen_seq, timeout):
+        """Block until the change count for `username` differs from `seen_seq`, or `timeout` seconds pass.
+
+        Returns the current change count, which the caller should pass back in as `seen_seq` next time.
+        Passing `None` returns immediately, which is how a client finds out where to start.
+        """
+        with self._lock:
+            if seen_seq is not None:
+                self._conditions[username].wait_for(lambda: self._seqs[username] != seen_seq, timeout)
+            return self._seqs[username]
@@ -0,0 +1,57 @@
+"""Finds players by the start of their username, without searching the users table.
+
+The index is a sorted list of usernames, so a search is a binary search for the prefix, and then a short walk.
+It's built from the users table once, the first time it's needed, and kept up to date from then on.
+"""
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+
+class PrefixIndex:
+    """Case insensitive: usernames are kept sorted by their lowercase form."""
+
+    def __init__(self, load_usernames):
+        """`load_usernames()` returns every username to start with. It's only called once."""
+        self.load_usernames = load_usernames
+        self._keys = None  # Sorted (lowercase username, username) pairs
+        self._lock = threading.Lock()
+
+    def _ensure_built(self):
+        """Has to be called holding the lock."""
+        if self._keys is None:
+            self._keys = sorted((username.lower(), username) for username in self.load_usernames())
+
+    def add(self, username):
+        key = (username.lower(), username)
+        with self._lock:
+            if self._keys is None:
+                return  # Will be included when the index is built
+            i = bisect_left(self._keys, key)
+            if i == len(self._keys) or self._keys[i] != key:
+                insort(self._keys, key)
+
+    def remove(self, username):
+        key = (username.lower(), username)
+        with self._lock:
+            if self._keys is None:
+                return
+            i = bisect_left(self._keys, key)
+            if i < len(self._keys) and self._keys[i] == key:
+                del self._keys[i]
+
+    def search(self, prefix, limit, after=None):
+        """Up to `limit` usernames starting with `prefix`, in order, after the username `after` (for paging).
+
+        Returns the usernames, and whether there are more after them.
+        """
+        prefix = prefix.lower()
+        with self._lock:
+            self._ensure_built()
+            i = bisect_left(self._keys, (prefix, ""))
+            if after is not None:
+                i = max(i, bisect_right(self._keys, (after.lower(), after)))
+            matches = []
+            while i < len(self._keys) and self._keys[i][0].startswith(prefix) and len(matches) <= limit:
+                matches.append(self._keys[i][1])
+                i += 1
+        return matches[:limit], len(matches) > limit
@@ -0,0 +1,97 @@
+"""A fixed pool of worker threads that runs the server callables.
+
+The uplink hands each incoming call its own thread, so on its own, a burst of calls all hit the tables at once.
+Instead, calls are handed to a pool of `workers` threads, with at most `max_queue` calls waiting for a free one.
+Individual callables can also be limited to a number of calls at once, so a slow one can't take over every worker.
+
+When the pool is saturated, calls are turned away straight away with `BUSY_MESSAGE`, rather than piling up.
+"""
+import functools
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+BUSY_MESSAGE = "The server is busy right now. Please try again in a moment."
+
+
+def parse_limits(spec):
+    """Turn "get_incomplete_games=2,login=4" into {"get_incomplete_games": 2, "login": 4}."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, limit = item.split("=")
+        limits[name.strip()] = int(limit)
+    return limits
+
+
+class WorkerPool:
+    def __init__(self, workers, max_queue, limits=None, limit_timeout=5):
+        """`limit_timeout` is how long (in seconds) a call waits on its callable's limit before giving up."""
+        self.limits = dict(limits or {})
+        self.limit_timeout = limit_timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._limit_semaphores = {name: threading.BoundedSemaphore(limit) for name, limit in self.limits.items()}
+        self._in_flight = defaultdict(int)
+        self._rejected = defaultdict(int)
+        self.resize(workers, max_queue)
+
+    def resize(self, workers, max_queue=None):
+        """Swap in a new set of workers. Calls already running finish on the old ones."""
+        self.workers = workers
+        self.max_queue = self.max_queue if max_queue is None else max_queue
+        old = getattr(self, "_executor", None)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sonora-worker")
+        self._slots = threading.BoundedSemaphore(workers + self.max_queue)
+        if old is not None:
+            old.shutdown(wait=False)
+
+    def _run(self, f, args, kwargs):
+        self._local.in_worker = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            self._local.in_worker = False
+
+    def _reject(self, name):
+        with self._lock:
+            self._rejected[name] += 1
+        return BUSY_MESSAGE
+
+    def wrap(self, name, f):
+        """Run each call to `f` on the pool, or return `BUSY_MESSAGE` if there's no room."""
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if getattr(self._local, "in_worker", False):  # A callable calling another callable
+                return f(*args, **kwargs)
+
+            limit = self._limit_semaphores.get(name)
+            if limit is not None and not limit.acquire(timeout=self.limit_timeout):
+                return self._reject(name)
+            try:
+                slots = self._slots
+                if not slots.acquire(blocking=False):
+                    return self._reject(name)
+                with self._lock:
+                    self._in_flight[name] += 1
+                try:
+                    return self._executor.submit(self._run, f, args, kwargs).result()
+                finally:
+                    with self._lock:
+                        self._in_flight[name] -= 1
+                    slots.release()
+            finally:
+                if limit is not None:
+                    limit.release()
+
+        return wrapper
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "limits": dict(self.limits),
+                "in_flight": {name: count for name, count in self._in_flight.items() if count},
+                "rejected": dict(self._rejected),
+            }
@@ -0,0 +1,53 @@
+"""Every server callable is registered through here, rather than with `anvil.server.callable` directly.
+
+That gives us one place to wrap all of them (with metrics, the worker pool and coalescing),
+and a lookup of everything that's been registered.
+
+The pool is configured with environment variables:
+
+* SONORA_WORKERS: how many calls can run at once (default 8)
+* SONORA_MAX_QUEUE: how many more can wait for a worker before calls are turned away (default 64)
+* SONORA_CALLABLE_LIMITS: per-callable limits on calls at once, like "get_incomplete_games=2,login=4"
+
+When running as several shards, callables about a single game are also registered under a name
+for this shard (see `sonora.routing`), so that clients can send a game's calls to the shard that owns it.
+"""
+import os
+
+import anvil.server
+
+from sonora.routing import shard_name
+from sonora.server_dir.metrics import metrics
+from sonora.server_dir.pool import WorkerPool, parse_limits
+from sonora.server_dir.shards import SHARD, SHARD_COUNT
+from sonora.server_dir.singleflight import flights
+
+pool = WorkerPool(
+    workers=int(os.environ.get("SONORA_WORKERS", 8)),
+    max_queue=int(os.environ.get("SONORA_MAX_QUEUE", 64)),
+    limits=parse_limits(os.environ.get("SONORA_CALLABLE_LIMITS", "")),
+)
+callables = {}
+
+
+def register(f=None, *, pooled=True, sharded=False, coalesced=False):
+    """Use as a decorator in place of `@anvil.server.callable`.
+
+    Callables that mostly sit and wait (like long polls) should use `@register(pooled=False)`,
+    so they don't tie up a worker.
+    Callables about a single game should use `@register(sharded=True)`.
+    Reads that are often made by several clients at once should use `@register(coalesced=True)`.
+    Identical calls then share one trip to the backend, and only that one takes up a worker.
+    """
+    if f is None:
+        return lambda f: register(f, pooled=pooled, sharded=sharded, coalesced=coalesced)
+    name = f.__name__
+    wrapped = metrics.wrap(name, f)
+    if pooled:
+        wrapped = pool.wrap(name, wrapped)
+    if coalesced:
+        wrapped = flights.wrap(name, wrapped)
+    callables[name] = wrapped
+    if sharded and SHARD_COUNT > 1:
+        anvil.server.callable(shard_name(name, SHARD))(wrapped)
+    return anvil.server.callable(wrapped)
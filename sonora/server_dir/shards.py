@@ -0,0 +1,76 @@
+"""Keeps several server processes (shards) in agreement about things they each hold in memory.
+
+Each shard has its own user cache and its own long-poll waiters, but they share one backend.
+So anything that changes one of those is published to the `changes` table,
+and every shard tails that table, applying what the others have published.
+
+With a single shard, nothing goes through the table at all.
+
+Shards are configured with environment variables (`run_server.py --shards N` sets them):
+
+* SONORA_SHARDS: how many shards there are (default 1)
+* SONORA_SHARD: which one this process is (default 0)
+"""
+import os
+import threading
+import time
+
+from loguru import logger
+
+SHARD_COUNT = int(os.environ.get("SONORA_SHARDS", 1))
+SHARD = int(os.environ.get("SONORA_SHARD", 0))
+
+# A change can be published a little before it's visible to other shards, so re-read this much of the table.
+LAG = 2  # seconds
+# Changes older than this are deleted (by shard 0).
+RETENTION = 60  # seconds
+
+
+class ChangeFeed:
+    def __init__(self, table, q, handlers):
+        """`handlers` maps each kind of change to a function that applies it, given the change's key."""
+        self.table = table
+        self.q = q
+        self.handlers = handlers
+
+    @property
+    def shared(self):
+        return SHARD_COUNT > 1
+
+    def publish(self, kind, *keys):
+        """Apply a change here straight away, and have every other shard apply it soon after."""
+        for key in keys:
+            self.handlers[kind](key)
+        if self.shared:
+            now = time.time()
+            for key in keys:
+                self.table.add_row(kind=kind, key=key, shard=SHARD, at=now)
+
+    def start(self, interval=0.2):
+        if self.shared:
+            threading.Thread(target=self.tail, args=(interval,), daemon=True).start()
+
+    def tail(self, interval):
+        cursor = time.time()
+        seen = {}  # Row ids we've already applied, along with when they were published
+        next_cleanup = cursor + RETENTION
+        while True:
+            time.sleep(interval)
+            now = time.time()
+            try:
+                for change in self.table.search(at=self.q.greater_than(cursor - LAG)):
+                    change_id = change.get_id()
+                    if change_id in seen:
+                        continue
+                    seen[change_id] = change["at"]
+                    if change["shard"] != SHARD:
+                        self.handlers[change["kind"]](change["key"])
+                if SHARD == 0 and now >= next_cleanup:
+                    for change in self.table.search(at=self.q.less_than(now - RETENTION)):
+                        change.delete()
+                    next_cleanup = now + RETENTION
+            except Exception as err:  # Keep tailing through dropped connections and the like
+                logger.warning(f"Couldn't read the change feed ({err}). Retrying shortly.")
+                continue
+            cursor = now
+            seen = {change_id: at for change_id, at in seen.items() if at >= cursor - LAG}
@@ -0,0 +1,100 @@
+"""Lets identical reads that arrive at the same time share a single trip to the backend.
+
+The first call for some arguments (the leader) does the work. Any identical calls that arrive before it finishes
+wait for it, and get the same result (or the same exception). Nothing is kept once the leader is done,
+so this is not a cache: a call that arrives afterwards does the work again.
+Calls also stop joining a flight once `invalidate` is called (after every write),
+so a client that's been told about a change can't be handed a result read from before it.
+
+Only use this for reads. The result is shared between callers, so it mustn't be changed by any of them.
+"""
+import functools
+import threading
+from collections import defaultdict
+
+
+def freeze(value):
+    """A hashable version of `value`, so it can be part of a key. Lists become tuples, dicts become sorted tuples."""
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    hash(value)  # Raises TypeError for anything else we can't use
+    return value
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._generation = 0
+        self._calls = defaultdict(int)
+        self._coalesced = defaultdict(int)
+
+    def invalidate(self):
+        """Calls from now on won't join any flight that's already underway."""
+        with self._lock:
+            self._generation += 1
+
+    def do(self, key, f):
+        """Call `f`, unless a call with the same `key` is already underway. Either way, return its result.
+
+        The first item of `key` is the name that stats are kept under.
+        """
+        with self._lock:
+            self._calls[key[0]] += 1
+            key = (*key, self._generation)
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self._coalesced[key[0]] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = f()
+            return flight.result
+        except Exception as err:
+            flight.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def wrap(self, name, f):
+        """Coalesce calls to `f` that have the same arguments."""
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            try:
+                key = (name, freeze(args), freeze(kwargs))
+            except TypeError:
+                return f(*args, **kwargs)
+            return self.do(key, lambda: f(*args, **kwargs))
+
+        return wrapper
+
+    def coalesce(self, f):
+        """Decorator version of `wrap`, named after `f`."""
+        return self.wrap(f.__name__, f)
+
+    def stats(self):
+        with self._lock:
+            return {name: {"calls": calls, "coalesced": self._coalesced[name]} for name, calls in self._calls.items()}
+
+
+flights = SingleFlight()
@@ -0,0 +1,62 @@
+"""The subset of `anvil.tables.query` that the server uses, for the SQLite backend. Plus `order_by`.
+
+Each query knows how to turn itself into a piece of a WHERE clause.
+"""
+
+
+class not_:
+    """Matches anything except `value`, including empty cells (like Anvil does)."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def to_sql(self, table, col):
+        return f"({col} IS NULL OR {col} != ?)", [table.encode_for_query(col, self.value)]
+
+
+class greater_than:
+    def __init__(self, value):
+        self.value = value
+
+    def to_sql(self, table, col):
+        return f"{col} > ?", [table.encode_for_query(col, self.value)]
+
+
+class less_than:
+    def __init__(self, value):
+        self.value = value
+
+    def to_sql(self, table, col):
+        return f"{col} < ?", [table.encode_for_query(col, self.value)]
+
+
+class order_by:
+    """Not a condition, but passed to `search` the same way, like in Anvil."""
+
+    def __init__(self, col, ascending=True):
+        self.col = col
+        self.ascending = ascending
+
+    def to_order_sql(self):
+        return f"{self.col} {'ASC' if self.ascending else 'DESC'}"
+
+
+class any_of:
+    """Either `any_of(a, b)` as a value (matches a or b), or `any_of(col1=a, col2=b)` as a whole query."""
+
+    def __init__(self, *values, **cols):
+        self.values = values
+        self.cols = cols
+
+    def to_sql(self, table, col=None):
+        if col is not None:
+            params = [table.encode_for_query(col, value) for value in self.values]
+            if not params:
+                return "0", []
+            return f"{col} IN ({', '.join('?' * len(params))})", params
+        clauses, params = [], []
+        for col_name, value in self.cols.items():
+            clause, col_params = table.where_clause(col_name, value)
+            clauses.append(clause)
+            params.extend(col_params)
+        return f"({' OR '.join(clauses)})", params
@@ -0,0 +1,372 @@
+"""A stand-in for `anvil.tables`, backed by SQLite, so the server can run (and be load tested) without Anvil.
+
+Only the subset of the API that `sonora.server` uses is here:
+tables with `get`, `get_by_id`, `search` and `add_row`,
+rows with item get/set, `update`, `get_id` and `delete`,
+plus `BlobMedia` and `in_transaction`.
+
+Every thread gets its own connection. Writes outside of `in_transaction` are committed immediately.
+"""
+import functools
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+# Column types are one of: text, number, bool, datetime, media, object, or link:<table>.
+SCHEMA = {
+    "users": {
+        "username": "text",
+        "email": "text",
+        "password_hash": "text",
+        "enabled": "bool",
+    },
+    "games": {
+        "player1": "link:users",
+        "player2": "link:users",
+        "player1_board": "media",
+        "player2_board": "media",
+        "player1_board_animals": "text",
+        "player2_board_animals": "text",
+        "player1_board_misses": "text",
+        "player2_board_misses": "text",
+        "player1_board_hash": "text",
+        "player2_board_hash": "text",
+        "player1_board_left": "number",
+        "player2_board_left": "number",
+        "status": "text",
+        "setup_status": "text",
+        "turn": "link:users",
+        "winner": "link:users",
+        "version": "number",
+        "pair_key": "text",
+        "keyframe_version": "number",
+    },
+    "moves": {
+        "game": "link:games",
+        "shooter": "text",
+        "row": "number",
+        "col": "text",
+        "hit": "bool",
+        "version": "number",
+    },
+    "active_games": {
+        "user": "link:users",
+        "game": "link:games",
+        "pair_key": "text",
+    },
+    "sessions": {
+        "user": "link:users",
+        "token": "text",
+        "expires": "datetime",
+    },
+    "archived_games": {
+        "game_id": "text",
+        "player1": "link:users",
+        "player2": "link:users",
+        "winner": "link:users",
+        "pair_key": "text",
+        "version": "number",
+        "finished": "datetime",
+        "player1_board": "object",
+        "player2_board": "object",
+        "player1_board_animals": "text",
+        "player1_board_misses": "text",
+        "player2_board_animals": "text",
+        "player2_board_misses": "text",
+        "moves": "object",
+        "purged": "bool",
+    },
+    "changes": {
+        "kind": "text",
+        "key": "text",
+        "shard": "number",
+        "at": "number",
+    },
+}
+
+INDEXES = {
+    "users": [("username",)],
+    "games": [("pair_key",)],
+    "moves": [("game", "version")],
+    "active_games": [("user", "pair_key"), ("game",)],
+    "sessions": [("token",)],
+    "archived_games": [("game_id",), ("player1", "finished"), ("player2", "finished"), ("purged", "finished")],
+    "changes": [("at",)],
+}
+
+SQL_TYPES = {"text": "TEXT", "number": "REAL", "bool": "INTEGER", "datetime": "TEXT", "media": "BLOB", "object": "TEXT"}
+
+
+class BlobMedia:
+    """Matches the bits of `anvil.BlobMedia` that the server uses."""
+
+    def __init__(self, content_type, content, name=None):
+        self.content_type = content_type
+        self._content = content
+        self.name = name
+
+    def get_bytes(self):
+        return self._content
+
+    @property
+    def length(self):
+        return len(self._content)
+
+
+_LAZY = object()
+
+
+class Row:
+    """A row that loads all of its simple columns in one go, the first time any of them is needed.
+
+    Like Anvil, media columns aren't read until they are asked for, so reading a game doesn't drag the boards along.
+    """
+
+    def __init__(self, table, row_id, values=None):
+        self._table = table
+        self._id = row_id
+        self._values = values
+
+    def __repr__(self):
+        return f"<Row {self._table.name}[{self._id}]>"
+
+    def __eq__(self, other):
+        return isinstance(other, Row) and (self._table.name, self._id) == (other._table.name, other._id)
+
+    def __hash__(self):
+        return hash((self._table.name, self._id))
+
+    def __getitem__(self, col):
+        if self._values is None:
+            self.update()
+        if self._values[col] is _LAZY:
+            self._values[col] = self._table.fetch_media(self._id, col)
+        return self._table.decode(col, self._values[col])
+
+    def __setitem__(self, col, value):
+        self.update(**{col: value})
+
+    def __iter__(self):
+        """(column, value) pairs, like iterating over an Anvil row (so `dict(row)` works)."""
+        return ((col, self[col]) for col in self._table.cols)
+
+    def get_id(self):
+        return str(self._id)
+
+    def update(self, **cols):
+        """Like Anvil: with no arguments, re-fetch the row. Otherwise, write all of `cols` at once."""
+        if not cols:
+            self._values = self._table.fetch_values(self._id)
+            return
+        encoded = {col: self._table.encode(col, value) for col, value in cols.items()}
+        assignments = ", ".join(f"{col} = ?" for col in self._table.sql_cols(encoded))
+        self._table.db.execute(
+            f"UPDATE {self._table.name} SET {assignments} WHERE id = ?",
+            [*self._table.sql_values(encoded), self._id],
+        )
+        if self._values is not None:
+            self._values.update(encoded)
+
+    def delete(self):
+        self._table.db.execute(f"DELETE FROM {self._table.name} WHERE id = ?", [self._id])
+
+
+class Table:
+    def __init__(self, db, name, cols):
+        self.db = db
+        self.name = name
+        self.cols = cols
+
+    def sql_cols(self, encoded):
+        """Media columns are stored as two SQL columns: the bytes and the content type."""
+        for col in encoded:
+            yield col
+            if self.cols[col] == "media":
+                yield f"{col}_content_type"
+
+    def sql_values(self, encoded):
+        for col, value in encoded.items():
+            if self.cols[col] == "media":
+                yield None if value is None else value[1]
+                yield None if value is None else value[0]
+            else:
+                yield value
+
+    def encode(self, col, value):
+        col_type = self.cols[col]
+        if value is None:
+            return None
+        if col_type.startswith("link:"):
+            return value._id
+        if col_type == "bool":
+            return int(value)
+        if col_type == "datetime":
+            return value.isoformat()
+        if col_type == "media":
+            return value.content_type, value.get_bytes()
+        if col_type == "object":
+            return json.dumps(value)
+        return value
+
+    def encode_for_query(self, col, value):
+        encoded = self.encode(col, value)
+        if self.cols[col] == "media":
+            raise ValueError(f"Can't search on media column {col}.")
+        return encoded
+
+    def decode(self, col, value):
+        col_type = self.cols[col]
+        if value is None:
+            return None
+        if col_type.startswith("link:"):
+            return Row(getattr(self.db.app_tables, col_type[len("link:") :]), value)
+        if col_type == "bool":
+            return bool(value)
+        if col_type == "number" and value == int(value):
+            return int(value)
+        if col_type == "datetime":
+            return datetime.fromisoformat(value)
+        if col_type == "media":
+            content_type, content = value
+            return BlobMedia(content_type, content)
+        if col_type == "object":
+            return json.loads(value)
+        return value
+
+    def where_clause(self, col, value):
+        if hasattr(value, "to_sql"):
+            return value.to_sql(self, col)
+        if value is None:
+            return f"{col} IS NULL", []
+        return f"{col} = ?", [self.encode_for_query(col, value)]
+
+    def select(self, args, kwargs, limit=None):
+        clauses, params, orderings = [], [], []
+        for query in args:
+            if hasattr(query, "to_order_sql"):
+                orderings.append(query.to_order_sql())
+                continue
+            clause, query_params = query.to_sql(self)
+            clauses.append(clause)
+            params.extend(query_params)
+        for col, value in kwargs.items():
+            clause, col_params = self.where_clause(col, value)
+            clauses.append(clause)
+            params.extend(col_params)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        order = f"ORDER BY {', '.join(orderings)}" if orderings else ""
+        limit = f"LIMIT {limit}" if limit is not None else ""
+        sql = f"SELECT {self.simple_cols} FROM {self.name} {where} {order} {limit}"
+        rows = self.db.execute(sql, params).fetchall()
+        return [Row(self, sql_row["id"], self.unpack(sql_row)) for sql_row in rows]
+
+    @property
+    def simple_cols(self):
+        return ", ".join(["id", *(col for col, col_type in self.cols.items() if col_type != "media")])
+
+    def unpack(self, sql_row):
+        return {col: _LAZY if col_type == "media" else sql_row[col] for col, col_type in self.cols.items()}
+
+    def fetch_values(self, row_id):
+        sql_row = self.db.execute(f"SELECT {self.simple_cols} FROM {self.name} WHERE id = ?", [row_id]).fetchone()
+        return None if sql_row is None else self.unpack(sql_row)
+
+    def fetch_media(self, row_id, col):
+        sql = f"SELECT {col}, {col}_content_type FROM {self.name} WHERE id = ?"
+        sql_row = self.db.execute(sql, [row_id]).fetchone()
+        return None if sql_row[col] is None else (sql_row[f"{col}_content_type"], sql_row[col])
+
+    def get(self, *args, **kwargs):
+        rows = self.select(args, kwargs, limit=2)
+        if len(rows) > 1:
+            raise ValueError(f"More than one row in {self.name} matched {args} {kwargs}")
+        return rows[0] if rows else None
+
+    def get_by_id(self, row_id):
+        values = self.fetch_values(int(row_id))
+        return None if values is None else Row(self, int(row_id), values)
+
+    def search(self, *args, **kwargs):
+        return self.select(args, kwargs)
+
+    def add_row(self, **cols):
+        encoded = {col: self.encode(col, value) for col, value in cols.items()}
+        names = list(self.sql_cols(encoded))
+        cursor = self.db.execute(
+            f"INSERT INTO {self.name} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+            list(self.sql_values(encoded)),
+        )
+        return self.get_by_id(cursor.lastrowid)
+
+
+class Database:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self.app_tables = AppTables(self)
+        self.create_schema()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # isolation_level=None means autocommit, unless we explicitly BEGIN in `in_transaction`.
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def execute(self, sql, params=()):
+        return self.connection.execute(sql, list(params))
+
+    def create_schema(self):
+        """Create any missing tables, columns and indexes. Safe to run against an existing database."""
+        for name, cols in SCHEMA.items():
+            self.execute(f"CREATE TABLE IF NOT EXISTS {name} (id INTEGER PRIMARY KEY AUTOINCREMENT)")
+            existing = {info["name"] for info in self.execute(f"PRAGMA table_info({name})")}
+            for col, col_type in cols.items():
+                sql_cols = {col: "INTEGER" if col_type.startswith("link:") else SQL_TYPES[col_type]}
+                if col_type == "media":
+                    sql_cols[f"{col}_content_type"] = "TEXT"
+                for sql_col, sql_type in sql_cols.items():
+                    if sql_col not in existing:
+                        self.execute(f"ALTER TABLE {name} ADD COLUMN {sql_col} {sql_type}")
+            for index_cols in INDEXES.get(name, []):
+                index_name = f"{name}_{'_'.join(index_cols)}"
+                self.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {name} ({', '.join(index_cols)})")
+
+    def in_transaction(self, f):
+        """Decorator with the same idea as `anvil.tables.in_transaction`.
+
+        Nested calls just join the outer transaction.
+        """
+
+        @functools.wraps(f)
+        def new_f(*args, **kwargs):
+            if self.connection.in_transaction:
+                return f(*args, **kwargs)
+            self.execute("BEGIN IMMEDIATE")
+            try:
+                result = f(*args, **kwargs)
+            except BaseException:
+                self.execute("ROLLBACK")
+                raise
+            self.execute("COMMIT")
+            return result
+
+        return new_f
+
+
+class AppTables:
+    def __init__(self, db):
+        self._db = db
+        self._tables = {name: Table(db, name, cols) for name, cols in SCHEMA.items()}
+
+    def __getattr__(self, name):
+        try:
+            return self._tables[name]
+        except KeyError:
+            raise AttributeError(f"There is no table named {name}.") from None
@@ -3,6 +3,7 @@ from string import ascii_uppercase
 
 UPLINK_CLIENT_KEY = "DLVI5O6VBFTJ5QVEZILJTYLN-FCSV6U7Z5JICT2KO-CLIENT"
 COLS = ascii_uppercase[:10]
+LONG_POLL_TIMEOUT = 20  # seconds
 
 
 class SonoraColor(Enum):
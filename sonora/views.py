@@ -1,4 +1,8 @@
+import threading
+
+import anvil.server
 from kivy.app import App
+from kivy.clock import Clock
 from kivy.core.window import Window
 from kivy.graphics import Color, Rectangle
 from kivy.uix.boxlayout import BoxLayout
@@ -17,6 +21,7 @@ from sonora.buttons import (
     CreateGameBtn,
     DoSomethingBtn,
     ExitSetupBtn,
+    FindOpponentBtn,
     GotoCreateAccountBtn,
     GotoCreateGameBtn,
     GotoLoginScreenBtn,
@@ -25,6 +30,7 @@ from sonora.buttons import (
     GotoYourBoardBtn,
     LoginBtn,
     OppBoardBtn,
+    PlayerSuggestionBtn,
     ResumeGameBtn,
     SetupBoardBtn,
     TakeTurnBtn,
@@ -35,6 +41,9 @@ from sonora.data import get_img
 from sonora.popups import NotificationPopup
 from sonora.static import COLS, Key, SonoraColor, Status
 
+AUTOCOMPLETE_DELAY = 0.2  # seconds
+AUTOCOMPLETE_SUGGESTIONS = 4
+
 
 def set_background_color(label, color):
     """Add a background color to a Label
@@ -301,7 +310,7 @@ class SetupGameScreen(Screen, ModelViewer):
         self.layout.add_widget(NextOrReset())
 
 
-class CreateGameScreen(SonoraScreen):
+class CreateGameScreen(SonoraScreen, ModelViewer):
     def __init__(self, **kwargs):
         super(CreateGameScreen, self).__init__(**kwargs)
         self.name = "create_game"
@@ -313,11 +322,47 @@ class CreateGameScreen(SonoraScreen):
         self.username_space.add_widget(Label(text="Username:"))
         self.username = TextInput(multiline=False, write_tab=False)
         self.username_space.add_widget(self.username)
+        self.suggestions = BoxLayout(orientation="horizontal", size_hint=(1, 0.05))
+        self.layout.add_widget(self.suggestions)
         self.create_game_btn = CreateGameBtn()
         self.layout.add_widget(self.create_game_btn)
+        self.layout.add_widget(Label(text="Or play whoever is looking for a game", size_hint=(1, 0.1)))
+        self.layout.add_widget(FindOpponentBtn())
         self.layout.add_widget(BackHomeScreenBtn())
-        self.layout.add_widget(BoxLayout(size_hint=(1, 0.75)))
+        self.layout.add_widget(BoxLayout(size_hint=(1, 0.5)))
         Window.bind(on_key_down=self._on_keyboard_down)
+        self.search_event = None
+        self.username.bind(text=self.schedule_search)
+
+    def schedule_search(self, _, text):
+        """Wait for a pause in the typing before asking the server for suggestions."""
+        if self.search_event is not None:
+            self.search_event.cancel()
+        if not text:
+            self.suggestions.clear_widgets()
+            return
+        self.search_event = Clock.schedule_once(lambda _: self.search_players(text), AUTOCOMPLETE_DELAY)
+
+    def search_players(self, prefix):
+        """The call is made from a background thread, so typing never waits on the server."""
+
+        def search():
+            try:
+                result = anvil.server.call("search_players", prefix, AUTOCOMPLETE_SUGGESTIONS + 1)
+            except Exception as err:
+                logger.warning(f"Couldn't search for players ({err}).")
+                return
+            Clock.schedule_once(lambda _: self.show_suggestions(prefix, result))
+
+        threading.Thread(target=search, daemon=True).start()
+
+    def show_suggestions(self, prefix, result):
+        if prefix != self.username.text or isinstance(result, str):  # Typing has moved on, or the server is busy
+            return
+        self.suggestions.clear_widgets()
+        players = [player for player in result["players"] if player not in (prefix, self.user.username)]
+        for player in players[:AUTOCOMPLETE_SUGGESTIONS]:
+            self.suggestions.add_widget(PlayerSuggestionBtn(player, self.username))
 
     def _on_keyboard_down(self, instance, keyboard, keycode, text, modifiers):
         if self.is_current_screen and keycode == Key.ENTER.value:
@@ -348,15 +393,15 @@ class IncompleteGames(GridLayout, ModelViewer):
         super(IncompleteGames, self).__init__(**kwargs)
         self.cols = 4
         self.size_hint = (1, 0.8)
-        self.user.bind(game_rows=self.update_game_buttons)
+        self.user.bind(game_summaries=self.update_game_buttons)
 
     def update_game_buttons(self, arg1, arg2):
         # Even though only incomplete games are returned on load, a game can become complete afterwards.
         self.clear_widgets()
-        for game_row in self.user.game_rows:
-            if game_row["status"] == Status.COMPLETE.value:
+        for game_summary in self.user.game_summaries:
+            if game_summary["status"] == Status.COMPLETE.value:
                 continue
-            game_btn = ResumeGameBtn(game_row)
+            game_btn = ResumeGameBtn(game_summary)
             self.add_widget(game_btn)
 
 
@@ -377,6 +422,11 @@ class UserHomeScreen(SonoraScreen, ModelViewer):
         self.db_poll.bind(winner=self.announce_win)
         self.db_poll.bind(polled_opp_finish_turn=self.announce_your_turn)
 
+    def on_enter(self, *args):
+        """Catch up on anything the poller noticed while we were on another screen."""
+        if self.db_poll.home_screen_stale:
+            self.db_poll.scan_home_screen(None)
+
     def announce_win(self, arg1, winner):
         self.incomplete_games.clear_widgets()
         self.incomplete_games.update_game_buttons(None, None)
@@ -0,0 +1,55 @@
+"""64-bit Zobrist hashes of boards, so two copies of a board can be compared without comparing their contents.
+
+Every fact about a board has a random 64-bit key, and a board's hash is the XOR of the keys of the facts that are
+true of it. The facts are: an animal of some type anchored on some square, a shot segment on some square,
+and a Miss or a Photo on some square.
+Since XOR undoes itself, `Board` keeps its hash up to date as things change, by XORing in just the keys that changed.
+
+The keys come from a fixed seed, so every client and server agrees on them. Never change `SEED`, or the order
+the keys are made in, since hashes are stored in the tables.
+"""
+import random
+
+from sonora.board_codec import ANIMAL_IDS, ANIMALS, SQUARES, square_index
+from sonora.board_objects import Animal, Miss, Photo
+
+SEED = 2023
+BITS = 64
+
+_rng = random.Random(SEED)
+ANIMAL_KEYS = [[_rng.getrandbits(BITS) for _ in range(SQUARES)] for _ in ANIMALS]
+SHOT_KEYS = [_rng.getrandbits(BITS) for _ in range(SQUARES)]
+MISS_KEYS = [_rng.getrandbits(BITS) for _ in range(SQUARES)]
+PHOTO_KEYS = [_rng.getrandbits(BITS) for _ in range(SQUARES)]
+
+
+def shot_key(loc):
+    return SHOT_KEYS[square_index(*loc)]
+
+
+def obj_key(obj):
+    """The keys of everything `obj` adds to a board, XORed together. Shot segments count as part of an animal."""
+    if isinstance(obj, Animal):
+        key = ANIMAL_KEYS[ANIMAL_IDS[type(obj)] - 1][square_index(obj.base_row, obj.base_col)]
+        for seg in obj.segments:
+            if seg.shot:
+                key ^= shot_key(seg.loc)
+        return key
+    if isinstance(obj, Miss):
+        return MISS_KEYS[square_index(*obj.loc)]
+    if isinstance(obj, Photo):
+        return PHOTO_KEYS[square_index(*obj.loc)]
+    raise TypeError(f"Can't hash {obj}.")
+
+
+def board_hash(contents):
+    """The hash of `Board.contents`, from scratch."""
+    key = 0
+    for obj in contents:
+        key ^= obj_key(obj)
+    return key
+
+
+def to_text(key):
+    """Hashes are stored as text, since they don't fit in the tables' number columns."""
+    return f"{key:016x}"
@@ -0,0 +1,29 @@
+"""
+Archive every completed game that isn't in `archived_games` yet, then purge them all from `games`.
+
+The server archives games as they're won, and purges them an hour later (see `sonora.server_dir.archive`).
+This is for the games that finished before the archive existed, which have no move log.
+Needs the server uplink key, since it works on the tables directly:
+
+    SONORA_UPLINK_KEY=... python tests/tools/archive_completed_games.py
+
+It's safe to run more than once.
+"""
+import os
+from datetime import datetime, timezone
+
+import anvil.server
+import anvil.tables.query as q
+from anvil.tables import app_tables
+
+from sonora.server_dir.archive import archive_game, purge_archived_games
+from sonora.static import Status
+
+anvil.server.connect(os.environ["SONORA_UPLINK_KEY"])
+
+archived = 0
+for game in app_tables.games.search(status=Status.COMPLETE.value):
+    archive_game(app_tables, game)
+    archived += 1
+print(f"Archived {archived} games")
+print(f"Purged {purge_archived_games(app_tables, q, datetime.now(timezone.utc))} games")
@@ -0,0 +1,37 @@
+"""
+Fill in `pair_key` and the `active_games` membership table for games created before they existed.
+
+Needs the server uplink key, since it works on the tables directly:
+
+    SONORA_UPLINK_KEY=... python tests/tools/backfill_active_games.py
+
+It's safe to run more than once.
+
+Pairs used to be able to start a second game while they already had one going.
+Those pairs are reported at the end, rather than merged, since both games may have been played.
+The server treats the first one it finds as the pair's active game, so finish or delete the others.
+"""
+import os
+from collections import defaultdict
+
+import anvil.server
+import anvil.tables.query as q
+from anvil.tables import app_tables
+
+from sonora.routing import pair_key
+
+anvil.server.connect(os.environ["SONORA_UPLINK_KEY"])
+
+games_by_pair = defaultdict(list)
+for game in app_tables.games.search(status=q.not_("COMPLETE")):
+    key = pair_key(game["player1"]["username"], game["player2"]["username"])
+    games_by_pair[key].append(game.get_id())
+    game["pair_key"] = key
+    for player in (game["player1"], game["player2"]):
+        if app_tables.active_games.get(user=player, game=game) is None:
+            app_tables.active_games.add_row(user=player, game=game, pair_key=key)
+    print(f"Backfilled {key}")
+
+for key, game_ids in games_by_pair.items():
+    if len(game_ids) > 1:
+        print(f"{key} has {len(game_ids)} active games: {', '.join(map(str, game_ids))}")
@@ -0,0 +1,59 @@
+"""
+Compare the binary board format (`sonora.board_codec`) with the gzipped pickles that boards used to be stored as.
+
+For each board in tests/data, plus an empty board, this prints how many bytes each format takes,
+and how long encoding and decoding take (the best of several runs, per board).
+
+Usage:
+
+    python tests/tools/board_codec_benchmark.py [--number 2000]
+"""
+import argparse
+import json
+import os
+import pickle
+import timeit
+from gzip import compress
+from pathlib import Path
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--number", type=int, default=2000, help="Encodes/decodes per run")
+parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement (the best one is reported)")
+args = parser.parse_args()
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+
+from sonora import board_codec  # noqa: E402
+
+DATA_DIR = Path(__file__).parents[1] / "data"
+
+
+def pickled_encode(contents):
+    """What `Game._commit_either_board` used to store: a gzipped pickle of `Board.serialize()`."""
+    return compress(pickle.dumps([board_obj.serialize() for board_obj in contents]))
+
+
+def best_us(f):
+    """Microseconds per call, from the fastest run."""
+    return min(timeit.repeat(f, number=args.number, repeat=args.repeat)) / args.number * 1e6
+
+
+def main():
+    boards = {"empty": []}
+    for path in sorted(DATA_DIR.glob("*.json")):
+        boards[path.stem] = board_codec.from_serialized(json.load(open(path)))
+
+    print(f"{'board':<16} {'format':<8} {'bytes':>6} {'encode µs':>10} {'decode µs':>10}")
+    for name, contents in boards.items():
+        pickled = pickled_encode(contents)
+        binary = board_codec.encode(contents)
+        assert board_codec.encode(board_codec.decode(pickled)) == binary
+        assert board_codec.encode(board_codec.decode(binary)) == binary
+        for fmt, data, encode in (("pickle", pickled, pickled_encode), ("binary", binary, board_codec.encode)):
+            encode_us = best_us(lambda: encode(contents))
+            decode_us = best_us(lambda: board_codec.decode(data))
+            print(f"{name:<16} {fmt:<8} {len(data):>6} {encode_us:>10.1f} {decode_us:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Load test the server by playing lots of games at once against a local SQLite backend.
+
+Every simulated client is a thread that plays a full game through the real callables:
+create_account, login, create_game, setup, then turns until someone wins.
+While it isn't their turn, a client polls like DBPoll does when it falls back to interval polling
+(`get_game_version` every 3 seconds and `get_home_snapshot` every 5),
+and fetches the opponent's move with `get_moves` once it's their turn.
+
+Usage, from the root of the repo (which has to be on PYTHONPATH, so `sonora` can be imported):
+
+    PYTHONPATH=. python tests/tools/load_test.py --clients 2 8 32 --time-scale 0.01
+
+`--time-scale` shrinks the polling intervals (0.01 turns 3 seconds into 30ms), so a full run doesn't take all day.
+For each client count, this prints throughput and p50/p95/p99 latency per callable,
+followed by a summary across client counts, so it's easy to see where the server saturates.
+
+To see how throughput scales with the size of the server's worker pool, try several worker counts.
+SQLite answers much faster than Anvil's tables do over the uplink, so add some latency to every table operation:
+
+    PYTHONPATH=. python tests/tools/load_test.py --clients 32 --workers 1 4 16 --table-latency-ms 5
+
+Calls turned away by a saturated pool are retried after a short wait, and counted as rejected.
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--clients", type=int, nargs="+", default=[2, 8, 32], help="Client counts to try (must be even)")
+parser.add_argument("--time-scale", type=float, default=0.01, help="Multiplier for the polling intervals")
+parser.add_argument("--db", default=os.path.join(tempfile.mkdtemp(), "load_test.db"), help="SQLite file to use")
+parser.add_argument("--workers", type=int, nargs="+", help="Worker pool sizes to try (default: SONORA_WORKERS)")
+parser.add_argument("--table-latency-ms", type=float, default=0, help="Added to every table operation")
+parser.add_argument("--metrics-file", help="Where to write the server's per-callable metrics at the end")
+args = parser.parse_args()
+
+# These have to be set before the server is imported.
+os.environ["SONORA_BACKEND"] = "sqlite"
+os.environ["SONORA_DB"] = args.db
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+
+import bcrypt  # noqa: E402
+from loguru import logger  # noqa: E402
+
+from sonora import server  # noqa: E402
+from sonora.board_objects import AnimalTypes  # noqa: E402
+from sonora.models import Board  # noqa: E402
+from sonora.server_dir.metrics import CountingAppTables  # noqa: E402
+from sonora.server_dir.pool import BUSY_MESSAGE  # noqa: E402
+from sonora.static import COLS, SetupStatus, Status  # noqa: E402
+
+logger.remove()
+logger.add(sys.stderr, level="WARNING")
+
+PASSWORD = "load-test"
+# Cheap rounds, so the test measures the server rather than bcrypt.
+PASSWORD_HASH = bcrypt.hashpw(bytes(PASSWORD, encoding="utf8"), bcrypt.gensalt(rounds=4)).decode("utf-8")
+GAME_VERSION_INTERVAL = 3
+HOME_SNAPSHOT_INTERVAL = 5
+BUSY_RETRY_INTERVAL = 0.05
+
+
+class SlowTables:
+    """Sleeps before every table operation, to stand in for the round trip to Anvil's tables."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def count_table_op(self):
+        time.sleep(self.latency)
+
+
+class Recorder:
+    """Collects the latency of every call, per callable."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def call(self, name, *call_args, **call_kwargs):
+        while True:
+            start = time.perf_counter()
+            result = getattr(server, name)(*call_args, **call_kwargs)
+            elapsed = time.perf_counter() - start
+            if result != BUSY_MESSAGE:
+                break
+            with self.lock:
+                self.rejected += 1
+            time.sleep(BUSY_RETRY_INTERVAL)
+        with self.lock:
+            self.latencies[name].append(elapsed)
+        return result
+
+
+def percentile(sorted_values, p):
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def random_board():
+    """Place every animal somewhere it fits, the same way the setup screen allows."""
+    board = Board()
+    for animal_type in AnimalTypes:
+        while True:
+            row, col = random.randint(1, 10), random.choice(COLS)
+            locs = []
+            for rel_row, rel_col in animal_type.value.cls_segments:
+                col_index = COLS.find(col) + rel_col
+                locs.append((row + rel_row, COLS[col_index] if 0 <= col_index < len(COLS) else None))
+            if all(loc in board.grid and board.grid[loc].obj is None for loc in locs):
+                board + animal_type.value(row, col)
+                break
+    return board
+
+
+def play(recorder, username, opponent_name, challenger, setup_barrier):
+    recorder.call("create_account", username, PASSWORD_HASH)
+    token = recorder.call("login", username, PASSWORD)["token"]
+    setup_barrier.wait()  # Both accounts have to exist before the game can be created
+
+    if challenger:
+        game_id = recorder.call("create_game", username, opponent_name)["game_id"]
+    else:
+        game_id = None
+        while game_id is None:
+            time.sleep(HOME_SNAPSHOT_INTERVAL * args.time_scale)
+            games = recorder.call("get_home_snapshot", username)
+            game_id = games[0]["game_id"] if games else None
+
+    summary = next(s for s in recorder.call("get_home_snapshot", username) if s["game_id"] == game_id)
+    board_col = "player1_board" if summary["player1"] == username else "player2_board"
+    recorder.call("update_game", token, game_id, **random_board().to_cols(board_col))
+    setup_barrier.wait()
+    if challenger:
+        recorder.call(
+            "update_game", token, game_id, setup_status=SetupStatus.COMPLETE.value, status=Status.ACTIVE.value
+        )
+    setup_barrier.wait()
+
+    untried = [(row, col) for row in range(1, 11) for col in COLS]
+    random.shuffle(untried)
+    next_snapshot = time.monotonic()
+    seen_version = 0
+    while True:
+        version, turn, winner = recorder.call("get_game_version", game_id)
+        if winner is not None:
+            return
+        if turn == username:
+            if version != seen_version:
+                recorder.call("get_moves", game_id, seen_version)
+            outcome = recorder.call("take_turn", token, game_id, *untried.pop())
+            if outcome["won"]:
+                return
+            seen_version = outcome["version"]
+            continue
+        time.sleep(GAME_VERSION_INTERVAL * args.time_scale)
+        if time.monotonic() >= next_snapshot:
+            recorder.call("get_home_snapshot", username, [game_id])
+            next_snapshot = time.monotonic() + HOME_SNAPSHOT_INTERVAL * args.time_scale
+
+
+def run(n_clients, run_id):
+    recorder = Recorder()
+    threads = []
+    for pair in range(n_clients // 2):
+        names = f"{run_id}-p{pair}-a", f"{run_id}-p{pair}-b"
+        barrier = threading.Barrier(2)
+        threads.append(threading.Thread(target=play, args=(recorder, names[0], names[1], True, barrier)))
+        threads.append(threading.Thread(target=play, args=(recorder, names[1], names[0], False, barrier)))
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    total_calls = sum(len(latencies) for latencies in recorder.latencies.values())
+    print(
+        f"\n{n_clients} clients, {server.pool.workers} workers: {total_calls} calls in {wall:.2f}s "
+        f"({total_calls / wall:.1f} calls/s, {recorder.rejected} rejected)"
+    )
+    print(f"{'callable':<20}{'calls':>8}{'calls/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, latencies in sorted(recorder.latencies.items()):
+        latencies = sorted(latencies)
+        p50, p95, p99 = (percentile(latencies, p) * 1000 for p in (50, 95, 99))
+        print(f"{name:<20}{len(latencies):>8}{len(latencies) / wall:>10.1f}{p50:>10.2f}{p95:>10.2f}{p99:>10.2f}")
+    take_turns = sorted(recorder.latencies["take_turn"])
+    return total_calls / wall, percentile(take_turns, 99) * 1000
+
+
+if __name__ == "__main__":
+    if any(n % 2 for n in args.clients):
+        parser.error("Client counts must be even, since clients play each other in pairs.")
+    print(f"Using {args.db}")
+    if args.table_latency_ms:
+        server.app_tables = CountingAppTables(server.app_tables, SlowTables(args.table_latency_ms / 1000))
+    run_id = int(time.time())
+    curve = []
+    for workers in args.workers or [server.pool.workers]:
+        server.pool.resize(workers)
+        for n in args.clients:
+            curve.append((workers, n, *run(n, f"{run_id}-{workers}-{n}")))
+
+    print("\nSaturation curve:")
+    print(f"{'workers':>8}{'clients':>8}{'calls/s':>10}{'take_turn p99 ms':>18}")
+    for workers, n_clients, throughput, p99 in curve:
+        print(f"{workers:>8}{n_clients:>8}{throughput:>10.1f}{p99:>18.2f}")
+
+    print("\nCoalesced calls (identical reads that shared one trip to the backend):")
+    for name, counts in sorted(server.flights.stats().items()):
+        print(f"{name:<20}{counts['coalesced']:>8} of {counts['calls']}")
+
+    if args.metrics_file:
+        server.metrics.dump(args.metrics_file)
+        print(f"\nServer metrics written to {args.metrics_file}")
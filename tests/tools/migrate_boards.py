@@ -0,0 +1,181 @@
+"""
+Move the boards of existing games out of the old `player1_board`/`player2_board` media columns,
+and into the plain columns that boards are kept in now (see `Board.to_cols`).
+
+Games are read a page at a time. Their boards are decoded and re-encoded across a pool of processes,
+and each page is written back in a single transaction. The old media columns are left as they are.
+Games that already have the new columns are skipped, so it's safe to run more than once.
+
+Only games that haven't been migrated yet are read, so an interrupted run just picks up where it left off.
+Games that fail to convert are recorded in a checkpoint file, and skipped on later runs
+unless `--retry-failed` is given.
+
+Against the Anvil tables (needs the server uplink key, since it works on the tables directly):
+
+    SONORA_UPLINK_KEY=... python tests/tools/migrate_boards.py
+
+Or against a local SQLite backend:
+
+    SONORA_BACKEND=sqlite SONORA_DB=sonora.db python tests/tools/migrate_boards.py
+
+`--dry-run` writes nothing (not even the checkpoint). Instead, every board is read back from the columns
+it would have been written to, and compared with the original, so any that wouldn't survive the move are reported.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--page-size", type=int, default=100, help="Games read, converted and written at a time")
+parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Size of the process pool")
+parser.add_argument("--checkpoint", default="migrate_boards.checkpoint.json", help="Where to keep progress")
+parser.add_argument("--dry-run", action="store_true", help="Check the round trip of every board, but write nothing")
+parser.add_argument("--retry-failed", action="store_true", help="Try games that failed on an earlier run again")
+args = parser.parse_args()
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+
+import anvil.server  # noqa: E402
+from loguru import logger  # noqa: E402
+
+from sonora import board_codec  # noqa: E402
+from sonora.models import Board  # noqa: E402
+from sonora.server_dir.backend import BACKEND, app_tables, in_transaction  # noqa: E402
+
+BOARD_COLS = ("player1_board", "player2_board")
+MAX_PAGES_IN_FLIGHT = 2  # Read the next page while the last one is being converted
+
+
+def convert(game_id, blobs, verify):
+    """Runs in the process pool. `blobs` has the bytes of each board column.
+
+    Returns the game's id, the new columns for both boards, and an error message (or None).
+    """
+    cols = {}
+    try:
+        for board_col, data in blobs.items():
+            board = Board.from_contents(board_codec.decode(data))
+            board_cols = board.to_cols(board_col)
+            if verify:
+                round_trip = Board.from_row(board_cols, board_col)
+                if board_codec.encode(round_trip.contents) != board_codec.encode(board.contents):
+                    return game_id, None, f"{board_col} doesn't survive the round trip"
+                if round_trip.hash != board.hash:
+                    return game_id, None, f"{board_col} has a different hash after the round trip"
+            cols.update(board_cols)
+    except Exception as err:
+        return game_id, None, f"{type(err).__name__}: {err}"
+    return game_id, cols, None
+
+
+def load_checkpoint():
+    if not os.path.exists(args.checkpoint):
+        return {"failed": {}}
+    with open(args.checkpoint) as f:
+        return json.load(f)
+
+
+def save_checkpoint(checkpoint):
+    """Written to a temporary file first, so an interruption can't leave a half written checkpoint."""
+    tmp = f"{args.checkpoint}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, args.checkpoint)
+
+
+def pages(skip):
+    """Games that still need migrating, as lists of (game id, {board col: bytes}), `args.page_size` at a time.
+
+    Writing a page back takes its games out of the search for unmigrated games, which would upset paging through it.
+    So each page comes from a new search, leaving out the games in `skip` (the ones that failed,
+    and the ones that are still being converted). A dry run writes nothing, so it pages through a single search.
+    """
+    games = iter(app_tables.games.search(player1_board_animals=None))
+    while True:
+        if not args.dry_run:
+            games = iter(app_tables.games.search(player1_board_animals=None))
+        page = list(islice((game for game in games if game.get_id() not in skip), args.page_size))
+        if not page:
+            return
+        yield [(game.get_id(), {board_col: game[board_col].get_bytes() for board_col in BOARD_COLS}) for game in page]
+
+
+@in_transaction
+def write_page(converted):
+    for game_id, cols in converted:
+        game = app_tables.games.get_by_id(game_id)
+        if game["player1_board_animals"] is None:  # Unless something else has written the board since
+            game.update(**cols)
+
+
+def main():
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    if BACKEND == "anvil":
+        anvil.server.connect(os.environ["SONORA_UPLINK_KEY"])
+
+    checkpoint = {"failed": {}} if args.dry_run else load_checkpoint()
+    if args.retry_failed:
+        checkpoint["failed"] = {}
+    skip = set(checkpoint["failed"])  # Plus the games that are being converted, until they're written
+    if skip:
+        print(f"Skipping {len(skip)} games that failed on an earlier run")
+
+    migrated, failed, bytes_in, bytes_out = 0, 0, 0, 0
+    start = time.perf_counter()
+
+    def finish(futures, page_start):
+        nonlocal migrated, failed, bytes_out
+        converted = []
+        for future in futures:
+            game_id, cols, err = future.result()
+            if err is None:
+                converted.append((game_id, cols))
+                bytes_out += sum(
+                    len(cols[f"{board_col}_{part}"]) for board_col in BOARD_COLS for part in ("animals", "misses")
+                )
+            else:
+                print(f"Game {game_id}: {err}")
+                checkpoint["failed"][game_id] = err
+        if not args.dry_run:
+            write_page(converted)
+            skip.difference_update(game_id for game_id, _ in converted)
+            save_checkpoint(checkpoint)
+        migrated += len(converted)
+        failed += len(futures) - len(converted)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{migrated + failed} games ({failed} failed) in {elapsed:.1f}s: "
+            f"{(migrated + failed) / elapsed:.1f} games/s overall, "
+            f"{len(futures) / (time.perf_counter() - page_start):.1f} games/s for the last page"
+        )
+
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        in_flight = deque()
+        for page in pages(skip):
+            skip.update(game_id for game_id, _ in page)
+            page_start = time.perf_counter()
+            bytes_in += sum(len(data) for _, blobs in page for data in blobs.values())
+            in_flight.append(
+                ([pool.submit(convert, game_id, blobs, args.dry_run) for game_id, blobs in page], page_start)
+            )
+            if len(in_flight) >= MAX_PAGES_IN_FLIGHT:
+                finish(*in_flight.popleft())
+        while in_flight:
+            finish(*in_flight.popleft())
+
+    elapsed = time.perf_counter() - start
+    verb = "Checked" if args.dry_run else "Migrated"
+    print(
+        f"{verb} {migrated} games ({failed} failed) in {elapsed:.1f}s ({migrated / max(elapsed, 1e-9):.1f} games/s). "
+        f"Boards went from {bytes_in} bytes of media to {bytes_out} characters of columns."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,37 @@
 """
 Upload arbitrary game state to the current game of "jk" vs "jack".
 
-Takes two args:
+Takes three args:
 
 1. The name of the player to upload to
-2. The path to the file that contains the json representation of the board.
+2. Their password (only players can write to a game, and only to their own board, while it's being set up)
+3. The path to the file that contains the json representation of the board.
 """
 import json
-import pickle
 import sys
-from gzip import compress
 
 import anvil.server
-from anvil import BlobMedia
 from more_itertools import only
 
-name_to_load_to, board_path = sys.argv[1:]
+from sonora import board_codec
+from sonora.models import Board
+
+name_to_load_to, password, board_path = sys.argv[1:]
 
 anvil.server.connect("DLVI5O6VBFTJ5QVEZILJTYLN-FCSV6U7Z5JICT2KO-CLIENT")
 
 games = anvil.server.call("get_incomplete_games", "jk")
-jk_vs_jack = only(g for g in games if g["player1"]["username"] == "jack" or g["player2"]["username"] == "jack")
-col_name = "player1_board" if jk_vs_jack["player1"]["username"] == name_to_load_to else "player1_board"
+jk_vs_jack = only(g for g in games if g["player1"] == "jack" or g["player2"] == "jack")
+col_name = "player1_board" if jk_vs_jack["player1"] == name_to_load_to else "player2_board"
 
 simple_board = json.load(open(board_path))
-jk_vs_jack[col_name] = BlobMedia("text/plain", compress(pickle.dumps(simple_board)))
+board = Board.from_contents(board_codec.from_serialized(simple_board))
+
+session = anvil.server.call("login", name_to_load_to, password)
+if isinstance(session, str):
+    sys.exit(session)
 
-# more temp?
-jk_vs_jack["status"] = "ACTIVE"
-jk_vs_jack["turn"] = jk_vs_jack["player2"]
-jk_vs_jack["winner"] = None
+# Go through the server so the version gets bumped and clients notice the change.
+result = anvil.server.call("update_game", session["token"], jk_vs_jack["game_id"], **board.to_cols(col_name))
+if isinstance(result, str):
+    sys.exit(result)